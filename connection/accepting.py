@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .blocking import exclude_blocked
+from .models import Connection, UserConnectionIntermediateTable
+from .sharding import record_friendships, record_removals
+from .versions import bump_versions
+
+
+def accept_pending_requests(user, since=None, chunk_size=500):
+    """
+    Accept every pending friend request sent to a user, set-based.
+
+    Requests are processed in chunks, each in its own short transaction, so
+    locks are held for a bounded time however many requests are pending.
+    A chunk costs nine statements whatever its size: the locking read, one
+    UPDATE of the requests, one DELETE of the user's own requests to the
+    same senders, two statements to make sure the senders have a connection
+    row, one DELETE per request table, one read of the senders' usernames
+    and one bulk INSERT of the friendships in both directions. Requests from
+    users related to the user by a block are left pending.
+
+    Args:
+        user (User): The user accepting the requests.
+        since (datetime): Only accept requests sent at or after this time.
+        chunk_size (int): The number of requests accepted per transaction.
+
+    Returns:
+        int: The number of requests accepted.
+    """
+    pending = exclude_blocked(Connection.objects.filter(to_user=user, accepted=False), user, field='from_user_id')
+    if since is not None:
+        pending = pending.filter(created_time__gte=since)
+    user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=user)
+
+    accepted = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                pending.select_for_update().filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'from_user_id')[:chunk_size]
+            )
+            if not rows:
+                return accepted
+            last_id = rows[-1][0]
+            accept_chunk(user_connections, rows)
+        accepted += len(rows)
+
+
+def accept_chunk(user_connections, rows):
+    """
+    Accept one chunk of requests sent to the owner of user_connections.
+
+    Requests the owner sent to the same users in return are deleted rather
+    than accepted, so each friendship stays a single accepted Connection.
+
+    Args:
+        user_connections (UserConnectionIntermediateTable): The accepting user's connections.
+        rows (list): The (connection id, sender id) of each request, locked by the caller.
+    """
+    user_id = user_connections.user_id
+    sender_ids = {sender_id for _, sender_id in rows}
+    accepted_time = timezone.now()
+    Connection.objects.filter(id__in=[connection_id for connection_id, _ in rows]).update(
+        accepted=True, accepted_time=accepted_time,
+    )
+    Connection.objects.filter(from_user_id=user_id, to_user_id__in=sender_ids, accepted=False).delete()
+
+    UserConnectionIntermediateTable.objects.bulk_create(
+        [UserConnectionIntermediateTable(user_id=sender_id) for sender_id in sender_ids], ignore_conflicts=True,
+    )
+    sender_tables = dict(
+        UserConnectionIntermediateTable.objects.filter(user_id__in=sender_ids).values_list('user_id', 'id')
+    )
+
+    # Both directions: the accepted requests and the user's requests in return
+    users_rows = Q(userconnectionintermediatetable_id=user_connections.id, user_id__in=sender_ids)
+    senders_rows = Q(userconnectionintermediatetable_id__in=sender_tables.values(), user_id=user_id)
+    UserConnectionIntermediateTable.pending_requests.through.objects.filter(users_rows | senders_rows).delete()
+    UserConnectionIntermediateTable.sent_requests.through.objects.filter(users_rows | senders_rows).delete()
+
+    friends = UserConnectionIntermediateTable.friends.through
+    friends.objects.bulk_create(
+        [friends(userconnectionintermediatetable_id=user_connections.id, user_id=sender_id, since=accepted_time)
+         for sender_id in sender_ids]
+        + [friends(userconnectionintermediatetable_id=sender_tables[sender_id], user_id=user_id, since=accepted_time)
+           for sender_id in sender_ids],
+        ignore_conflicts=True,
+    )
+
+    # Bulk statements bypass the m2m_changed signals
+    bump_versions(sender_ids | {user_id})
+    record_friendships((sender_id, user_id) for sender_id in sender_ids)
+    record_removals((user_id, sender_id) for sender_id in sender_ids)
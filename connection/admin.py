@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Connection, UserConnectionIntermediateTable
+from .models import ArchivedConnection, Block, Connection, UserConnectionIntermediateTable
 
 admin.site.register(Connection)
-admin.site.register(UserConnectionIntermediateTable)
\ No newline at end of file
+admin.site.register(UserConnectionIntermediateTable)
+admin.site.register(Block)
+admin.site.register(ArchivedConnection)
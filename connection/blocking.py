@@ -0,0 +1,108 @@
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Block, Connection, UserConnectionIntermediateTable
+from .sharding import record_removals
+
+BLOCK_SET_CACHE_KEY = 'connection:blocks:{}'
+BLOCK_SET_CACHE_TIMEOUT = 60 * 60
+
+
+def blocked_user_ids(user_id):
+    """
+    Return the ids of every user hidden from the given user.
+
+    The set contains users blocked by the given user as well as users who
+    blocked them, so a single membership test covers both directions. It is
+    cached per user and invalidated whenever one of their blocks changes.
+
+    Args:
+        user_id (int): The id of the user whose block set is requested.
+
+    Returns:
+        frozenset: The ids of the users hidden from the given user.
+    """
+    key = BLOCK_SET_CACHE_KEY.format(user_id)
+    block_set = cache.get(key)
+    if block_set is None:
+        pairs = Block.objects.filter(Q(blocker_id=user_id) | Q(blocked_id=user_id)).values_list('blocker_id', 'blocked_id')
+        block_set = frozenset(blocked if blocker == user_id else blocker for blocker, blocked in pairs)
+        cache.set(key, block_set, BLOCK_SET_CACHE_TIMEOUT)
+    return block_set
+
+
+def is_blocked(user_id, other_user_id):
+    """
+    Check whether either of two users has blocked the other.
+
+    Args:
+        user_id (int): The id of the first user.
+        other_user_id (int): The id of the second user.
+
+    Returns:
+        bool: True if a block exists in either direction.
+    """
+    return other_user_id in blocked_user_ids(user_id)
+
+
+def invalidate_block_cache(*user_ids):
+    """
+    Drop the cached block sets of the given users.
+
+    Args:
+        *user_ids (int): The ids of the users whose block sets changed.
+    """
+    cache.delete_many([BLOCK_SET_CACHE_KEY.format(user_id) for user_id in user_ids])
+
+
+def exclude_blocked(queryset, user, field='pk'):
+    """
+    Exclude users related to the given user by a block from a queryset.
+
+    The filter is expressed as correlated NOT EXISTS subqueries, one per
+    direction, so the database performs an anti-join against the block table
+    with each probe served by one of its composite indexes, instead of the
+    rows being checked one at a time in Python.
+
+    Args:
+        queryset (QuerySet): The queryset to filter.
+        user (User): The user whose blocks are applied.
+        field (str): The field of the queryset holding the other user's id.
+
+    Returns:
+        QuerySet: The filtered queryset.
+    """
+    blocking = Block.objects.filter(blocker=user, blocked=OuterRef(field))
+    blocked_by = Block.objects.filter(blocker=OuterRef(field), blocked=user)
+    return queryset.filter(~Exists(blocking), ~Exists(blocked_by))
+
+
+def cancel_requests_between(user, other_user):
+    """
+    Delete the pending friend requests between two users, in both directions.
+
+    Called when one of them blocks the other, so a request sent before the
+    block can no longer be accepted. Friendships are kept, the block only
+    hides them until it is removed.
+
+    Args:
+        user (User): The first user.
+        other_user (User): The second user.
+
+    Returns:
+        int: The number of requests deleted.
+    """
+    pending = Connection.objects.filter(
+        Q(from_user=user, to_user=other_user) | Q(from_user=other_user, to_user=user), accepted=False,
+    )
+    pairs = list(pending.values_list('from_user_id', 'to_user_id'))
+    pending.delete()
+
+    # Remove the mirrored M2M rows, including any left without a request
+    for connections in UserConnectionIntermediateTable.objects.filter(user__in=[user, other_user]):
+        peer = other_user if connections.user_id == user.id else user
+        connections.sent_requests.remove(peer)
+        connections.pending_requests.remove(peer)
+
+    record_removals(pairs)
+    return len(pairs)
@@ -0,0 +1,163 @@
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from heapq import merge
+from .models import Connection, UserConnectionIntermediateTable
+from .versions import bump_versions
+
+RELATIONS = ('friends', 'sent_requests', 'pending_requests')
+
+
+def expected_edges(relation, start, end):
+    """
+    Stream the (owner, user) pairs a relation should contain according to Connection.
+
+    Only pairs whose owner id lies in [start, end) are produced, sorted by
+    owner and then user.
+
+    Args:
+        relation (str): One of 'friends', 'sent_requests' or 'pending_requests'.
+        start (int): The lowest owner id included.
+        end (int): The owner id at which the range stops.
+
+    Returns:
+        iterator: The sorted (owner_id, user_id) pairs.
+    """
+    if relation == 'sent_requests':
+        return _stream(
+            Connection.objects.filter(accepted=False, from_user_id__gte=start, from_user_id__lt=end),
+            'from_user_id', 'to_user_id',
+        )
+    if relation == 'pending_requests':
+        return _stream(
+            Connection.objects.filter(accepted=False, to_user_id__gte=start, to_user_id__lt=end),
+            'to_user_id', 'from_user_id',
+        )
+    # An accepted connection makes each user a friend of the other
+    return merge(
+        _stream(Connection.objects.filter(accepted=True, from_user_id__gte=start, from_user_id__lt=end),
+                'from_user_id', 'to_user_id'),
+        _stream(Connection.objects.filter(accepted=True, to_user_id__gte=start, to_user_id__lt=end),
+                'to_user_id', 'from_user_id'),
+    )
+
+
+def actual_edges(relation, start, end):
+    """
+    Stream the rows of a relation's M2M table whose owner id lies in [start, end).
+
+    Args:
+        relation (str): One of 'friends', 'sent_requests' or 'pending_requests'.
+        start (int): The lowest owner id included.
+        end (int): The owner id at which the range stops.
+
+    Returns:
+        iterator: The (owner_id, user_id, row_id) tuples sorted by owner and user.
+    """
+    through = getattr(UserConnectionIntermediateTable, relation).through
+    queryset = through.objects.filter(
+        userconnectionintermediatetable__user_id__gte=start,
+        userconnectionintermediatetable__user_id__lt=end,
+    )
+    return _stream(queryset, 'userconnectionintermediatetable__user_id', 'user_id', 'id')
+
+
+def _stream(queryset, owner, user, *extra):
+    return queryset.order_by(owner, user).values_list(owner, user, *extra).iterator(chunk_size=2000)
+
+
+def diff_edges(expected, actual):
+    """
+    Merge-join two sorted edge streams and yield their differences.
+
+    Duplicate expected pairs, such as two accepted connections between the
+    same users, are collapsed.
+
+    Args:
+        expected (iterable): Sorted (owner_id, user_id) pairs that should exist.
+        actual (iterable): Sorted (owner_id, user_id, row_id) tuples that do exist.
+
+    Yields:
+        tuple: ('missing', (owner_id, user_id), None) for expected pairs without a row,
+               and ('extra', (owner_id, user_id), row_id) for rows without an expected pair.
+    """
+    expected = iter(expected)
+    actual = iter(actual)
+    want = next(expected, None)
+    have = next(actual, None)
+    while want is not None or have is not None:
+        if have is None or (want is not None and want < have[:2]):
+            yield 'missing', want, None
+            want = _next_distinct(expected, want)
+        elif want is None or have[:2] < want:
+            yield 'extra', have[:2], have[2]
+            have = next(actual, None)
+        else:
+            want = _next_distinct(expected, want)
+            have = next(actual, None)
+
+
+def _next_distinct(iterator, previous):
+    for item in iterator:
+        if item != previous:
+            return item
+    return None
+
+
+def connection_starts(relation, missing):
+    """
+    Look up when the connections behind missing pairs started, as list entries record it.
+
+    Args:
+        relation (str): One of 'friends', 'sent_requests' or 'pending_requests'.
+        missing (list): The (owner_id, user_id) pairs.
+
+    Returns:
+        dict: The start time of each pair found, keyed by the pair.
+    """
+    user_ids = {user for pair in missing for user in pair}
+    rows = Connection.objects.filter(
+        accepted=relation == 'friends', from_user_id__in=user_ids, to_user_id__in=user_ids,
+    ).values_list('from_user_id', 'to_user_id', Coalesce('accepted_time', 'created_time'))
+    starts = {}
+    for from_user, to_user, start in rows:
+        if relation == 'pending_requests':
+            starts[to_user, from_user] = start
+        else:
+            starts[from_user, to_user] = start
+            if relation == 'friends':
+                starts[to_user, from_user] = start
+    return starts
+
+
+def repair(relation, missing, extra):
+    """
+    Make a relation's M2M table match Connection for the given differences.
+
+    Args:
+        relation (str): One of 'friends', 'sent_requests' or 'pending_requests'.
+        missing (list): The (owner_id, user_id) pairs to insert.
+        extra (list): The ids of the M2M rows to delete.
+    """
+    through = getattr(UserConnectionIntermediateTable, relation).through
+    with transaction.atomic():
+        if extra:
+            stale = through.objects.filter(id__in=extra)
+            bump_versions(stale.values_list('userconnectionintermediatetable__user_id', flat=True))
+            stale.delete()
+        if missing:
+            owners = {owner for owner, _ in missing}
+            UserConnectionIntermediateTable.objects.bulk_create(
+                [UserConnectionIntermediateTable(user_id=owner) for owner in owners], ignore_conflicts=True,
+            )
+            tables = dict(
+                UserConnectionIntermediateTable.objects.filter(user_id__in=owners).values_list('user_id', 'id')
+            )
+            starts = connection_starts(relation, missing)
+            through.objects.bulk_create(
+                [through(userconnectionintermediatetable_id=tables[owner], user_id=user,
+                         since=starts.get((owner, user), timezone.now()))
+                 for owner, user in missing],
+                ignore_conflicts=True,
+            )
+            bump_versions(owners)
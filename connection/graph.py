@@ -0,0 +1,124 @@
+from . import sharding
+from .models import UserConnectionIntermediateTable
+from .snapshot import get_snapshot
+
+
+def load_friend_ids(user_ids):
+    """
+    Load the friends of a whole set of users with a single query.
+
+    Args:
+        user_ids (iterable): The ids of the users whose friends are loaded.
+
+    Returns:
+        set: The ids of every friend of at least one of the given users.
+    """
+    through = UserConnectionIntermediateTable.friends.through
+    return set(
+        through.objects.filter(userconnectionintermediatetable__user_id__in=list(user_ids))
+        .values_list('user_id', flat=True)
+    )
+
+
+def friend_loader():
+    """
+    Return the adjacency loader analytical features should use.
+
+    When a graph snapshot is configured with GRAPH_SNAPSHOT_DIR and has been
+    built, friends are read from its memory-mapped arrays, which may lag the
+    database by up to one refresh. Otherwise, when connection shards are
+    configured, they are read from the friends edges on the shards, with one
+    query per shard involved, and else queried from the default database.
+
+    Returns:
+        callable: Returns the set of friends of a set of user ids.
+    """
+    snapshot = get_snapshot()
+    if snapshot:
+        return snapshot.load_friend_ids
+    return sharding.load_friend_ids if sharding.sharding_enabled() else load_friend_ids
+
+
+def degrees_of_separation(source_id, target_id, max_depth, max_frontier, load_neighbors=load_friend_ids):
+    """
+    Compute the number of friendship hops between two users.
+
+    The search runs a breadth-first search from both users at once, always
+    expanding the smaller frontier, so it visits roughly the square root of
+    the nodes a one-sided search would. Each expansion loads the neighbors of
+    the whole frontier in one call.
+
+    Args:
+        source_id (int): The id of the user the path starts from.
+        target_id (int): The id of the user the path leads to.
+        max_depth (int): The longest path, in hops, that is searched for.
+        max_frontier (int): The largest frontier that is expanded before giving up.
+        load_neighbors (callable): Returns the set of neighbors of a set of user ids.
+
+    Returns:
+        int or None: The length of the shortest path, or None if there is no path
+                     within max_depth hops or the search outgrew max_frontier.
+    """
+    if source_id == target_id:
+        return 0
+
+    near = {source_id: 0}
+    far = {target_id: 0}
+    near_frontier = {source_id}
+    far_frontier = {target_id}
+    depth = 0
+
+    while near_frontier and far_frontier and depth < max_depth:
+        if len(near_frontier) > len(far_frontier):
+            near, far = far, near
+            near_frontier, far_frontier = far_frontier, near_frontier
+        if len(near_frontier) > max_frontier:
+            return None
+
+        level = near[next(iter(near_frontier))] + 1
+        near_frontier = load_neighbors(near_frontier).difference(near)
+        meetings = [far[user_id] for user_id in near_frontier if user_id in far]
+        if meetings:
+            return level + min(meetings)
+        for user_id in near_frontier:
+            near[user_id] = level
+        depth += 1
+
+    return None
+
+
+def distances_from(source_id, target_ids, max_depth, max_frontier, load_neighbors=load_friend_ids):
+    """
+    Compute the number of friendship hops from one user to several others.
+
+    A single breadth-first search is run from the source, stopping as soon as
+    every target has been reached.
+
+    Args:
+        source_id (int): The id of the user the paths start from.
+        target_ids (iterable): The ids of the users whose distance is requested.
+        max_depth (int): The longest path, in hops, that is searched for.
+        max_frontier (int): The largest frontier that is expanded before giving up.
+        load_neighbors (callable): Returns the set of neighbors of a set of user ids.
+
+    Returns:
+        dict: The distance of every target, None for targets that were not reached.
+    """
+    remaining = set(target_ids)
+    distances = dict.fromkeys(remaining)
+    if source_id in remaining:
+        distances[source_id] = 0
+        remaining.discard(source_id)
+
+    seen = {source_id}
+    frontier = {source_id}
+    level = 0
+    while remaining and frontier and level < max_depth and len(frontier) <= max_frontier:
+        level += 1
+        frontier = load_neighbors(frontier).difference(seen)
+        seen |= frontier
+        for user_id in remaining & frontier:
+            distances[user_id] = level
+        remaining -= frontier
+
+    return distances
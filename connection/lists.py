@@ -0,0 +1,44 @@
+from django.db.models import Q
+from .blocking import exclude_blocked
+from .models import UserConnectionIntermediateTable
+
+# Values of the 'ordering' query parameter of the list views
+ORDERINGS = ('recent', 'name')
+
+
+def connection_list(user, relation, ordering=None, keyword=None):
+    """
+    List the users of one of a user's relations, ordered and filtered in SQL.
+
+    The query starts from the user's entries of the relation, so it only
+    ever reads that user's slice of the entries and of auth_user. Entries
+    carry the start of the connection and the username, and both orderings
+    read them in the order of an (owner, key) index, without a sort.
+
+    Args:
+        user (User): The user whose list is returned.
+        relation (str): One of 'friends', 'sent_requests' or 'pending_requests'.
+        ordering (str): 'recent' for the most recently started connection
+                        first, or 'name' for by username. Unordered if None.
+        keyword (str): Only keep users whose username or name contains it.
+
+    Returns:
+        QuerySet: The (id, username, first_name, last_name, since) of each user.
+    """
+    through = getattr(UserConnectionIntermediateTable, relation).through
+    rows = exclude_blocked(
+        through.objects.filter(userconnectionintermediatetable__user_id=user.id), user, field='user_id',
+    )
+    if keyword:
+        rows = rows.filter(
+            Q(user__username__icontains=keyword)
+            | Q(user__first_name__icontains=keyword)
+            | Q(user__last_name__icontains=keyword)
+        )
+    if ordering == 'recent':
+        rows = rows.order_by('-since', '-id')
+    elif ordering == 'name':
+        rows = rows.order_by('username')
+    return rows.values_list(
+        'user_id', 'user__username', 'user__first_name', 'user__last_name', 'since',
+    )
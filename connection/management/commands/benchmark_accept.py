@@ -0,0 +1,68 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from connection.accepting import accept_pending_requests
+from connection.models import Connection, UserConnectionIntermediateTable
+from demo_social.testing import rolled_back
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare accepted friend requests per second, one request at a time and set-based'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000, help='Number of pending requests to accept')
+        parser.add_argument('--one-by-one', type=int, default=500,
+                            help='Number of them accepted one at a time through accept_friend_request first')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of requests accepted per transaction')
+
+    def handle(self, *args, **kwargs):
+        with rolled_back():
+            self.run(kwargs)
+
+    def run(self, options):
+        total = options['requests']
+        users = User.objects.bulk_create(User(username=f'bench_accept_{i}') for i in range(total + 1))
+        user, senders = users[0], users[1:]
+        user_connections = UserConnectionIntermediateTable.objects.create(user=user)
+        sender_connections = UserConnectionIntermediateTable.objects.bulk_create(
+            UserConnectionIntermediateTable(user=sender) for sender in senders
+        )
+        Connection.objects.bulk_create(Connection(from_user=sender, to_user=user) for sender in senders)
+        user_connections.pending_requests.add(*senders)
+        sent = UserConnectionIntermediateTable.sent_requests.through
+        sent.objects.bulk_create(
+            sent(userconnectionintermediatetable_id=connections.id, user_id=user.id) for connections in sender_connections
+        )
+
+        client = APIClient(SERVER_NAME='localhost')
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        url = reverse('accept_friend_request')
+        one_by_one = senders[:options['one_by_one']]
+
+        def accept_one_by_one():
+            for sender in one_by_one:
+                client.post(url, {'from_user_id': sender.id})
+            return len(one_by_one)
+
+        for name, accept in (
+            ('one at a time (accept_friend_request)', accept_one_by_one),
+            (f'set-based, chunks of {options["chunk_size"]}',
+             lambda: accept_pending_requests(user, chunk_size=options['chunk_size'])),
+        ):
+            statements = []
+            with connection.execute_wrapper(lambda execute, *args: statements.append(1) or execute(*args)):
+                started = time.perf_counter()
+                accepted = accept()
+                elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{name}: {accepted} requests in {elapsed:.3f}s, {accepted / max(elapsed, 1e-9):.0f} per second, '
+                f'{len(statements) / max(accepted, 1):.2f} statements per request'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{Connection.objects.filter(to_user=user, accepted=True).count()} of {total} requests accepted.'
+        ))
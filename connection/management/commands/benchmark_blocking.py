@@ -0,0 +1,58 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Value as V
+from django.db.models.functions import Concat
+from connection.blocking import blocked_user_ids, exclude_blocked, invalidate_block_cache
+from connection.models import Block, UserConnectionIntermediateTable
+from demo_social.testing import rolled_back
+import random
+import timeit
+
+
+class Command(BaseCommand):
+    help = 'Measure the latency added by block filtering on search and friend list queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Number of synthetic users to create')
+        parser.add_argument('--blocks', type=int, default=100, help='Number of blocks created by the benchmark user')
+        parser.add_argument('--friends', type=int, default=500, help='Number of friends of the benchmark user')
+        parser.add_argument('--repeat', type=int, default=200, help='Number of timed runs per query')
+
+    def handle(self, *args, **kwargs):
+        with rolled_back():
+            self.run(kwargs)
+
+    def run(self, options):
+        total = options['users']
+        users = User.objects.bulk_create(
+            User(username=f'bench_block_{i}', first_name=random.choice(['alice', 'bob', 'carol'])) for i in range(total)
+        )
+        user = users[0]
+        others = users[1:]
+        Block.objects.bulk_create(Block(blocker=user, blocked=other) for other in random.sample(others, options['blocks']))
+        user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=user)
+        user_connections.friends.add(*random.sample(others, options['friends']))
+
+        search = User.objects.annotate(full_name=Concat('first_name', V(' '), 'last_name')).filter(full_name__icontains='alice')
+        friends = user_connections.friends.all()
+        queries = [
+            ('search (count + first page)', lambda qs: (qs.count(), list(qs[:10])), search),
+            ('friend list', list, friends),
+        ]
+
+        repeat = options['repeat']
+        for name, run, queryset in queries:
+            plain = min(timeit.repeat(lambda: run(queryset.all()), number=1, repeat=repeat))
+            filtered_queryset = exclude_blocked(queryset, user)
+            filtered = min(timeit.repeat(lambda: run(filtered_queryset.all()), number=1, repeat=repeat))
+            self.stdout.write(
+                f'{name}: {plain * 1000:.3f} ms without blocks, {filtered * 1000:.3f} ms with blocks '
+                f'(+{(filtered - plain) * 1000:.3f} ms)'
+            )
+
+        invalidate_block_cache(user.id)
+        cold = timeit.timeit(lambda: blocked_user_ids(user.id), number=1)
+        warm = min(timeit.repeat(lambda: others[-1].id in blocked_user_ids(user.id), number=1000, repeat=5)) / 1000
+        invalidate_block_cache(user.id)
+        self.stdout.write(f'block set: {cold * 1000:.3f} ms to load, {warm * 1e6:.3f} us per cached membership test')
+        self.stdout.write(self.style.SUCCESS(f'Benchmark finished with {total} users.'))
@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from connection.models import UserConnectionIntermediateTable
+from demo_social.testing import rolled_back
+import time
+
+
+class Command(BaseCommand):
+    help = 'Measure the bandwidth and database time saved by conditional GETs on friend lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--friends', type=int, default=1000, help='Number of friends of the benchmark user')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests timed per case')
+
+    def handle(self, *args, **kwargs):
+        with rolled_back():
+            self.run(kwargs['friends'], kwargs['requests'])
+
+    def run(self, friends, requests):
+        users = User.objects.bulk_create(User(username=f'bench_etag_{i}') for i in range(friends + 1))
+        user = users[0]
+        UserConnectionIntermediateTable.objects.create(user=user).friends.add(*users[1:])
+        token = Token.objects.create(user=user)
+
+        client = APIClient(SERVER_NAME='localhost')
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('check_friends')
+        etag = client.get(url)['ETag']
+
+        results = {}
+        for name, headers in (('full response', {}), ('304 response', {'HTTP_IF_NONE_MATCH': etag})):
+            queries = []
+
+            def timed(execute, sql, params, many, context):
+                started = time.perf_counter()
+                try:
+                    return execute(sql, params, many, context)
+                finally:
+                    queries.append(time.perf_counter() - started)
+
+            with connection.execute_wrapper(timed):
+                started = time.perf_counter()
+                for _ in range(requests):
+                    response = client.get(url, **headers)
+                elapsed = (time.perf_counter() - started) / requests
+            db_time = sum(queries) / requests
+            results[name] = (len(response.content), elapsed, db_time)
+            self.stdout.write(
+                f'{name} ({response.status_code}): {len(response.content)} bytes, {elapsed * 1000:.3f} ms, '
+                f'{len(queries) / requests:.0f} queries taking {db_time * 1000:.3f} ms'
+            )
+
+        full, not_modified = results['full response'], results['304 response']
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved per revalidated request: {full[0] - not_modified[0]} bytes, '
+            f'{(full[1] - not_modified[1]) * 1000:.3f} ms, {(full[2] - not_modified[2]) * 1000:.3f} ms of query execution time.'
+        ))
@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from connection.graph import degrees_of_separation, load_friend_ids
+from connection.models import Connection, UserConnectionIntermediateTable
+from connection.snapshot import GraphSnapshot, build_snapshot
+from demo_social.testing import rolled_back
+import random
+import statistics
+import tempfile
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare degrees-of-separation latency with the database and the snapshot friend loaders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edges', type=int, nargs='+', default=[10 ** 4, 10 ** 5],
+                            help='Graph sizes, in friendships, to benchmark (each is written to the database)')
+        parser.add_argument('--degree', type=int, default=20, help='Average number of friends per user')
+        parser.add_argument('--queries', type=int, default=200, help='Number of random user pairs measured per graph')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random graph generator')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Number of rows inserted per query')
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs['seed'])
+        for edges in kwargs['edges']:
+            with rolled_back():
+                self.run(rng, edges, kwargs)
+
+    def run(self, rng, edges, options):
+        nodes = max(2, 2 * edges // options['degree'])
+        started = time.monotonic()
+        user_ids = self.seed_graph(rng, nodes, edges, options['batch_size'])
+        self.stdout.write(f'{edges} edges, {nodes} users written in {time.monotonic() - started:.1f}s.')
+
+        pairs = [(rng.choice(user_ids), rng.choice(user_ids)) for _ in range(options['queries'])]
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.monotonic()
+            build_snapshot(directory)
+            self.stdout.write(f'  snapshot built in {time.monotonic() - started:.1f}s')
+            # Both loaders answer the same searches over the same graph
+            results = {}
+            for name, loader in (('database', load_friend_ids), ('snapshot', GraphSnapshot(directory).load_friend_ids)):
+                results[name] = self.measure(name, loader, pairs)
+
+        if results['database'] != results['snapshot']:
+            self.stdout.write(self.style.ERROR('  The loaders found different distances.'))
+
+    def measure(self, name, loader, pairs):
+        """
+        Time a search for every pair with one friend loader.
+
+        Returns:
+            list: The distance found for every pair.
+        """
+        loads = []
+
+        def load_neighbors(user_ids):
+            loads.append(len(user_ids))
+            return loader(user_ids)
+
+        timings = []
+        levels = []
+        distances = []
+        for source, target in pairs:
+            del loads[:]
+            started = time.perf_counter()
+            distances.append(degrees_of_separation(source, target,
+                                                   max_depth=settings.CONNECTION_DISTANCE_MAX_DEPTH,
+                                                   max_frontier=settings.CONNECTION_DISTANCE_MAX_FRONTIER,
+                                                   load_neighbors=load_neighbors))
+            timings.append(time.perf_counter() - started)
+            levels.append(len(loads))
+
+        timings.sort()
+        found = sum(distance is not None for distance in distances)
+        self.stdout.write(
+            f'  {name}: median {statistics.median(timings) * 1000:.3f} ms, '
+            f'p95 {timings[int(len(timings) * 0.95)] * 1000:.3f} ms, '
+            f'{statistics.mean(levels):.2f} adjacency loads per search, '
+            f'{found}/{len(timings)} pairs connected within {settings.CONNECTION_DISTANCE_MAX_DEPTH} hops'
+        )
+        return distances
+
+    def seed_graph(self, rng, nodes, edges, batch_size):
+        """
+        Write a random undirected graph as accepted connections and friends rows.
+
+        Returns:
+            list: The ids of the users of the graph.
+        """
+        users = []
+        for start in range(0, nodes, batch_size):
+            users += User.objects.bulk_create(
+                User(username=f'bench_distance_{i}') for i in range(start, min(start + batch_size, nodes))
+            )
+        tables = UserConnectionIntermediateTable.objects.bulk_create(
+            (UserConnectionIntermediateTable(user=user) for user in users), batch_size=batch_size,
+        )
+
+        # The friends tables allow a pair only once, so draw distinct pairs
+        pairs = set()
+        edges = min(edges, nodes * (nodes - 1) // 2)
+        while len(pairs) < edges:
+            source, target = rng.randrange(nodes), rng.randrange(nodes)
+            if source != target:
+                pairs.add((min(source, target), max(source, target)))
+        pairs = list(pairs)
+
+        accepted_time = timezone.now()
+        friends = UserConnectionIntermediateTable.friends.through
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            Connection.objects.bulk_create(
+                Connection(from_user=users[source], to_user=users[target], accepted=True, accepted_time=accepted_time)
+                for source, target in batch
+            )
+            friends.objects.bulk_create(
+                [friends(userconnectionintermediatetable_id=tables[source].id, user_id=users[target].id)
+                 for source, target in batch]
+                + [friends(userconnectionintermediatetable_id=tables[target].id, user_id=users[source].id)
+                   for source, target in batch]
+            )
+        return [user.id for user in users]
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from connection.snapshot import build_snapshot, refresh_snapshot
+import time
+
+
+class Command(BaseCommand):
+    help = 'Export accepted connections into a memory-mapped CSR graph snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default=settings.GRAPH_SNAPSHOT_DIR,
+                            help='Snapshot directory, GRAPH_SNAPSHOT_DIR by default')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only apply the connections accepted since the current snapshot, '
+                                 'or rebuild it if connections were removed')
+
+    def handle(self, *args, **kwargs):
+        directory = kwargs['directory']
+        if not directory:
+            raise CommandError('Set GRAPH_SNAPSHOT_DIR or pass --directory.')
+
+        started = time.monotonic()
+        if kwargs['incremental']:
+            try:
+                manifest = refresh_snapshot(directory)
+            except FileNotFoundError:
+                raise CommandError(f'No snapshot in {directory}, build one without --incremental first.')
+            if manifest is None:
+                self.stdout.write(self.style.SUCCESS('Snapshot is up to date.'))
+                return
+        else:
+            manifest = build_snapshot(directory)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Snapshot version {manifest["version"]} written to {directory}: {manifest["nodes"]} users, '
+            f'{manifest["edges"]} friendships in {time.monotonic() - started:.2f}s.'
+        ))
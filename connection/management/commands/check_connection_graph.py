@@ -0,0 +1,80 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from connection.consistency import RELATIONS, actual_edges, diff_edges, expected_edges, repair
+import json
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'Check that the friends/sent/pending M2M tables agree with Connection, optionally repairing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of user ids checked per chunk')
+        parser.add_argument('--repair', action='store_true', help='Fix the M2M tables to match Connection')
+        parser.add_argument('--checkpoint', help='File recording progress, so an interrupted run can be resumed')
+        parser.add_argument('--show', type=int, default=20, help='Maximum number of differences printed')
+
+    def handle(self, *args, **kwargs):
+        chunk_size = kwargs['chunk_size']
+        checkpoint = kwargs['checkpoint']
+        start = self.load_checkpoint(checkpoint)
+        last_user_id = User.objects.aggregate(last=Max('id'))['last'] or 0
+        totals = {relation: {'missing': 0, 'extra': 0} for relation in RELATIONS}
+        shown = 0
+        started = time.monotonic()
+
+        if start:
+            self.stdout.write(f'Resuming from user id {start}.')
+
+        # Both representations are streamed per range of owner ids, so memory
+        # is bounded by the edges of one chunk of users.
+        while start <= last_user_id:
+            end = start + chunk_size
+            for relation in RELATIONS:
+                missing, extra = [], []
+                for kind, (owner, user), row_id in diff_edges(expected_edges(relation, start, end),
+                                                              actual_edges(relation, start, end)):
+                    totals[relation][kind] += 1
+                    if kind == 'missing':
+                        missing.append((owner, user))
+                    else:
+                        extra.append(row_id)
+                    if shown < kwargs['show']:
+                        shown += 1
+                        self.stdout.write(f'{kind} {relation}: user {owner} -> user {user}')
+                if kwargs['repair'] and (missing or extra):
+                    repair(relation, missing, extra)
+            start = end
+            self.save_checkpoint(checkpoint, start)
+            self.stdout.write(
+                f'Checked user ids below {min(start, last_user_id + 1)} of {last_user_id} '
+                f'({time.monotonic() - started:.1f}s elapsed).'
+            )
+
+        for relation, counts in totals.items():
+            self.stdout.write(f'{relation}: {counts["missing"]} missing, {counts["extra"]} extra')
+        found = sum(sum(counts.values()) for counts in totals.values())
+        if not found:
+            self.stdout.write(self.style.SUCCESS('Connection tables are consistent.'))
+        elif kwargs['repair']:
+            self.stdout.write(self.style.SUCCESS(f'{found} inconsistencies repaired.'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{found} inconsistencies found, rerun with --repair to fix them.'))
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def load_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as checkpoint:
+            return json.load(checkpoint)['next_user_id']
+
+    def save_checkpoint(self, path, next_user_id):
+        if not path:
+            return
+        with open(f'{path}.tmp', 'w') as checkpoint:
+            json.dump({'next_user_id': next_user_id}, checkpoint)
+        os.replace(f'{path}.tmp', path)
@@ -0,0 +1,110 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from connection.models import ArchivedConnection, Connection, UserConnectionIntermediateTable
+from connection.sharding import record_removals
+from connection.versions import bump_versions
+import time
+
+
+class Command(BaseCommand):
+    help = 'Expire and archive friend requests left pending for longer than the configured TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=int, default=settings.CONNECTION_PENDING_REQUEST_TTL_DAYS,
+                            help='Age in days after which a pending request expires')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of requests expired per transaction')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the requests that would expire')
+
+    def handle(self, *args, **kwargs):
+        cutoff = timezone.now() - timedelta(days=kwargs['ttl_days'])
+        stale = Connection.objects.filter(accepted=False, created_time__lt=cutoff)
+
+        if kwargs['dry_run']:
+            self.stdout.write(f'{stale.count()} pending requests older than {cutoff.isoformat()} would expire.')
+            return
+
+        total = 0
+        started = time.monotonic()
+        cursor = Q()
+        while True:
+            # Walking the (accepted, created_time) index oldest first keeps
+            # every batch a short range scan. The cursor moves past each
+            # batch even when all of it was accepted or rejected meanwhile.
+            batch_started = time.monotonic()
+            candidates = list(
+                stale.filter(cursor).order_by('created_time', 'id').values_list('id', 'created_time')[:kwargs['batch_size']]
+            )
+            if not candidates:
+                break
+            last_id, last_created_time = candidates[-1]
+            cursor = Q(created_time__gt=last_created_time) | Q(created_time=last_created_time, id__gt=last_id)
+
+            expired = self.expire_batch([candidate_id for candidate_id, _ in candidates])
+            total += expired
+            elapsed = time.monotonic() - batch_started
+            self.stdout.write(f'Expired {expired} requests in {elapsed:.3f}s ({expired / max(elapsed, 1e-9):.0f}/s).')
+            if kwargs['sleep']:
+                time.sleep(kwargs['sleep'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} pending requests expired in {elapsed:.3f}s ({total / max(elapsed, 1e-9):.0f}/s).'
+        ))
+
+    def expire_batch(self, candidate_ids):
+        """
+        Archive and delete one batch of stale requests in a single short transaction.
+
+        Args:
+            candidate_ids (list): The ids of the requests found stale.
+
+        Returns:
+            int: The number of requests expired.
+        """
+        with transaction.atomic():
+            # Re-read under lock so a request accepted meanwhile is left alone
+            rows = list(
+                Connection.objects.select_for_update()
+                .filter(id__in=candidate_ids, accepted=False)
+                .values_list('id', 'from_user_id', 'to_user_id', 'created_time')
+            )
+            if not rows:
+                return 0
+
+            ids = [row[0] for row in rows]
+            ArchivedConnection.objects.bulk_create(
+                ArchivedConnection(from_user_id=from_user_id, to_user_id=to_user_id, created_time=created_time)
+                for _, from_user_id, to_user_id, created_time in rows
+            )
+
+            # Remove the mirrored M2M rows. The IN list narrows each delete to
+            # an index range, and the correlated EXISTS keeps only the exact
+            # (owner, user) pairs of this batch.
+            pending_through = UserConnectionIntermediateTable.pending_requests.through
+            pending_through.objects.filter(
+                Exists(Connection.objects.filter(
+                    id__in=ids,
+                    to_user_id=OuterRef('userconnectionintermediatetable__user_id'),
+                    from_user_id=OuterRef('user_id'),
+                )),
+                user_id__in={row[1] for row in rows},
+            ).delete()
+            sent_through = UserConnectionIntermediateTable.sent_requests.through
+            sent_through.objects.filter(
+                Exists(Connection.objects.filter(
+                    id__in=ids,
+                    from_user_id=OuterRef('userconnectionintermediatetable__user_id'),
+                    to_user_id=OuterRef('user_id'),
+                )),
+                user_id__in={row[2] for row in rows},
+            ).delete()
+
+            Connection.objects.filter(id__in=ids).delete()
+            record_removals((from_user_id, to_user_id) for _, from_user_id, to_user_id, _ in rows)
+            bump_versions({row[1] for row in rows} | {row[2] for row in rows})
+        return len(ids)
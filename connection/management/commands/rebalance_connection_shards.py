@@ -0,0 +1,83 @@
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from connection.models import ConnectionEdge
+from connection.sharding import shard_for, sharding_enabled, sync_range
+import time
+
+
+class Command(BaseCommand):
+    help = 'Move connection edges to the shard their owner hashes to, after shards were added'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of edges scanned per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the edges that would move')
+        parser.add_argument('--sync', action='store_true',
+                            help='Afterwards, make every edge match the Connection table on the default database')
+
+    def handle(self, *args, **kwargs):
+        if not sharding_enabled():
+            raise CommandError('No connection shards are configured, set CONNECTION_SHARD_COUNT.')
+
+        started = time.monotonic()
+        for alias in settings.CONNECTION_SHARDS:
+            scanned, moved = self.rebalance(alias, kwargs['batch_size'], kwargs['dry_run'])
+            verb = 'would move' if kwargs['dry_run'] else 'moved'
+            self.stdout.write(f'{alias}: scanned {scanned} edges, {verb} {moved}.')
+
+        if kwargs['sync'] and not kwargs['dry_run']:
+            written = deleted = 0
+            last_user_id = User.objects.aggregate(last=Max('id'))['last'] or 0
+            for start in range(0, last_user_id + 1, kwargs['batch_size']):
+                range_written, range_deleted = sync_range(start, start + kwargs['batch_size'])
+                written += range_written
+                deleted += range_deleted
+            self.stdout.write(f'Synced with Connection: {written} edges written, {deleted} deleted.')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebalanced in {time.monotonic() - started:.3f}s.'))
+
+    def rebalance(self, alias, batch_size, dry_run):
+        """
+        Walk one shard by id and move the edges whose owner hashes elsewhere.
+
+        Edges are copied before they are deleted, so an owner's edges are always
+        readable somewhere. A copy never overwrites an edge already on the
+        target, since that one was dual-written after the shard was added.
+
+        Returns:
+            tuple: The number of edges scanned and moved.
+        """
+        scanned = moved = 0
+        last_id = 0
+        while True:
+            rows = list(
+                ConnectionEdge.objects.using(alias).filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'owner_id', 'peer_id', 'relation', 'created_time')[:batch_size]
+            )
+            if not rows:
+                return scanned, moved
+            scanned += len(rows)
+            last_id = rows[-1][0]
+
+            misplaced = defaultdict(list)
+            for row in rows:
+                target = shard_for(row[1])
+                if target != alias:
+                    misplaced[target].append(row)
+            moved += sum(len(target_rows) for target_rows in misplaced.values())
+            if dry_run or not misplaced:
+                continue
+
+            for target, target_rows in misplaced.items():
+                with transaction.atomic(using=target):
+                    ConnectionEdge.objects.using(target).bulk_create([
+                        ConnectionEdge(owner_id=owner_id, peer_id=peer_id, relation=relation, created_time=created_time)
+                        for _, owner_id, peer_id, relation, created_time in target_rows
+                    ], ignore_conflicts=True)
+            with transaction.atomic(using=alias):
+                ConnectionEdge.objects.using(alias).filter(
+                    id__in=[row[0] for target_rows in misplaced.values() for row in target_rows]
+                ).delete()
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.14 on 2026-10-19 13:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('connection', '0002_block'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedConnection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_time', models.DateTimeField()),
+                ('archived_time', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(fields=['accepted', 'created_time'], name='connection_pending_age_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedconnection',
+            name='from_user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_sent_connection', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedconnection',
+            name='to_user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_received_connection', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.14 on 2026-10-19 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connection', '0003_pending_request_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='connection',
+            name='accepted_time',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
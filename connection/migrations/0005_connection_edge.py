@@ -0,0 +1,28 @@
+# Generated by Django 4.2.14 on 2026-10-19 13:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connection', '0004_connection_accepted_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConnectionEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_id', models.BigIntegerField()),
+                ('peer_id', models.BigIntegerField()),
+                ('relation', models.CharField(choices=[('friends', 'Friends'), ('sent_requests', 'Sent request'), ('pending_requests', 'Pending request')], max_length=16)),
+                ('created_time', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='connectionedge',
+            constraint=models.UniqueConstraint(fields=('owner_id', 'peer_id', 'relation'), name='unique_connection_edge'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.14 on 2026-10-19 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connection', '0005_connection_edge'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(fields=['from_user', 'to_user', 'accepted', 'created_time', 'accepted_time'], name='connection_pair_idx'),
+        ),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 4.2.14 on 2026-10-19 14:45
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+import django.utils.timezone
+
+# The M2M tables Django created become explicit entry models in the state
+# only, the tables themselves keep their names, columns and constraints.
+ENTRIES = [
+    ('FriendEntry', 'friends', 'friends'),
+    ('SentRequestEntry', 'sent_requests', 'sent'),
+    ('PendingRequestEntry', 'pending_requests', 'pending'),
+]
+
+
+def entry_state(name, relation):
+    return migrations.CreateModel(
+        name=name,
+        fields=[
+            ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ('userconnectionintermediatetable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='connection.userconnectionintermediatetable')),
+        ],
+        options={
+            'db_table': f'connection_userconnectionintermediatetable_{relation}',
+            'unique_together': {('userconnectionintermediatetable', 'user')},
+        },
+    )
+
+
+def copy_since_and_usernames(apps, schema_editor):
+    """
+    Copy the start of each connection and the username onto the existing entries.
+    """
+    Connection = apps.get_model('connection', 'Connection')
+    UserConnectionIntermediateTable = apps.get_model('connection', 'UserConnectionIntermediateTable')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+
+    owner_id = Subquery(
+        UserConnectionIntermediateTable.objects.filter(id=OuterRef(OuterRef('userconnectionintermediatetable_id')))
+        .values('user_id')[:1]
+    )
+    connections = {
+        'SentRequestEntry': Connection.objects.filter(from_user_id=owner_id, to_user_id=OuterRef('user_id'))
+        .values('created_time'),
+        'PendingRequestEntry': Connection.objects.filter(from_user_id=OuterRef('user_id'), to_user_id=owner_id)
+        .values('created_time'),
+        'FriendEntry': Connection.objects.filter(
+            Q(from_user_id=owner_id, to_user_id=OuterRef('user_id'))
+            | Q(from_user_id=OuterRef('user_id'), to_user_id=owner_id),
+            accepted=True,
+        ).annotate(since=Coalesce('accepted_time', 'created_time')).values('since'),
+    }
+    for name, _, _ in ENTRIES:
+        apps.get_model('connection', name).objects.update(
+            # Entries without a connection keep the migration time
+            since=Coalesce(Subquery(connections[name][:1]), 'since'),
+            username=Subquery(User.objects.filter(id=OuterRef('user_id')).values('username')[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('connection', '0006_list_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                *(entry_state(name, relation) for name, relation, _ in ENTRIES),
+                *(
+                    migrations.AlterField(
+                        model_name='userconnectionintermediatetable',
+                        name=relation,
+                        field=models.ManyToManyField(related_name=relation, through=f'connection.{name}', to=settings.AUTH_USER_MODEL),
+                    )
+                    for name, relation, _ in ENTRIES
+                ),
+            ],
+        ),
+        *(
+            operation
+            for name, _, _ in ENTRIES
+            for operation in (
+                migrations.AddField(
+                    model_name=name.lower(),
+                    name='since',
+                    field=models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                migrations.AddField(
+                    model_name=name.lower(),
+                    name='username',
+                    field=models.CharField(default='', max_length=150),
+                ),
+            )
+        ),
+        migrations.RunPython(copy_since_and_usernames, migrations.RunPython.noop),
+        *(
+            migrations.AddIndex(
+                model_name=name.lower(),
+                index=models.Index(fields=['userconnectionintermediatetable', key], name=f'connection_{prefix}_{suffix}_idx'),
+            )
+            for name, _, prefix in ENTRIES
+            for key, suffix in (('since', 'since'), ('username', 'name'))
+        ),
+    ]
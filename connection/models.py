@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Connection(models.Model):
@@ -10,16 +11,46 @@ class Connection(models.Model):
         from_user (User): The user who sent the friend request.
         created_time (datetime): The timestamp when the connection was created.
         accepted (bool): Indicates whether the friend request is accepted.
+        accepted_time (datetime): The timestamp when the friend request was accepted.
     """
 
     to_user = models.ForeignKey(User, related_name='received_connection', on_delete=models.CASCADE)
     from_user = models.ForeignKey(User, related_name='sent_connection', on_delete=models.CASCADE)
     created_time = models.DateTimeField(auto_now_add=True)
     accepted = models.BooleanField(default=False)
+    accepted_time = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Serves the range scans of expire_pending_requests over stale pending requests.
+            models.Index(fields=['accepted', 'created_time'], name='connection_pending_age_idx'),
+            # Covers the per-row 'since' lookups of the friend and request lists.
+            models.Index(fields=['from_user', 'to_user', 'accepted', 'created_time', 'accepted_time'],
+                         name='connection_pair_idx'),
+        ]
 
     def __str__(self):
         return f"Connection from {self.from_user.username} to {self.to_user.username}"
 
+class ArchivedConnection(models.Model):
+    """
+    Represents a pending friend request that expired without being answered.
+
+    Attributes:
+        to_user (User): The user to whom the friend request was sent.
+        from_user (User): The user who sent the friend request.
+        created_time (datetime): The timestamp when the friend request was sent.
+        archived_time (datetime): The timestamp when the friend request was expired.
+    """
+
+    to_user = models.ForeignKey(User, related_name='archived_received_connection', on_delete=models.CASCADE)
+    from_user = models.ForeignKey(User, related_name='archived_sent_connection', on_delete=models.CASCADE)
+    created_time = models.DateTimeField()
+    archived_time = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Expired connection from {self.from_user.username} to {self.to_user.username}"
+
 class UserConnectionIntermediateTable(models.Model):
     """
     Represents the intermediate table for user connections.
@@ -31,10 +62,162 @@ class UserConnectionIntermediateTable(models.Model):
         pending_requests (ManyToManyField): The friend requests received by the user.
     """
     user = models.OneToOneField(User, related_name='connections', on_delete=models.CASCADE)
-    friends = models.ManyToManyField(User, related_name='friends')
-    sent_requests = models.ManyToManyField(User, related_name='sent_requests')
-    pending_requests = models.ManyToManyField(User, related_name='pending_requests')
+    friends = models.ManyToManyField(User, related_name='friends', through='FriendEntry')
+    sent_requests = models.ManyToManyField(User, related_name='sent_requests', through='SentRequestEntry')
+    pending_requests = models.ManyToManyField(User, related_name='pending_requests', through='PendingRequestEntry')
 
 
     def __str__(self):
         return f"{self.user.username}'s connection details"
+
+
+class ConnectionListEntryQuerySet(models.QuerySet):
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Create entries, filling in the usernames of those created without one.
+
+        The M2M managers' add() creates entries through here too, so every
+        entry carries the username it is sorted by.
+        """
+        objs = list(objs)
+        missing = {obj.user_id for obj in objs if not obj.username}
+        if missing:
+            usernames = dict(User.objects.filter(id__in=missing).values_list('id', 'username'))
+            for obj in objs:
+                if not obj.username:
+                    obj.username = usernames.get(obj.user_id, '')
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class ConnectionListEntry(models.Model):
+    """
+    Represents one user on one of another user's connection lists.
+
+    The start of the connection and the username are copied onto the entry,
+    so both orderings of a list are read from an (owner, key) index instead
+    of being sorted after the rows were read.
+
+    Attributes:
+        userconnectionintermediatetable (UserConnectionIntermediateTable): The connections of the list's owner.
+        user (User): The user on the list.
+        since (datetime): When the connection started: when the request was
+                          sent, or for friends when it was accepted.
+        username (str): The username of the user, kept up to date on renames.
+    """
+    userconnectionintermediatetable = models.ForeignKey(UserConnectionIntermediateTable, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    since = models.DateTimeField(default=timezone.now)
+    username = models.CharField(max_length=150, default='')
+
+    objects = ConnectionListEntryQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+        # Kept from the M2M tables Django created before the entries had fields
+        unique_together = [('userconnectionintermediatetable', 'user')]
+
+
+class FriendEntry(ConnectionListEntry):
+    """
+    A friend on a user's friend list.
+    """
+
+    class Meta(ConnectionListEntry.Meta):
+        db_table = 'connection_userconnectionintermediatetable_friends'
+        indexes = [
+            models.Index(fields=['userconnectionintermediatetable', 'since'], name='connection_friends_since_idx'),
+            models.Index(fields=['userconnectionintermediatetable', 'username'], name='connection_friends_name_idx'),
+        ]
+
+
+class SentRequestEntry(ConnectionListEntry):
+    """
+    A user a friend request was sent to, on the sender's sent list.
+    """
+
+    class Meta(ConnectionListEntry.Meta):
+        db_table = 'connection_userconnectionintermediatetable_sent_requests'
+        indexes = [
+            models.Index(fields=['userconnectionintermediatetable', 'since'], name='connection_sent_since_idx'),
+            models.Index(fields=['userconnectionintermediatetable', 'username'], name='connection_sent_name_idx'),
+        ]
+
+
+class PendingRequestEntry(ConnectionListEntry):
+    """
+    A user a friend request came from, on the receiver's pending list.
+    """
+
+    class Meta(ConnectionListEntry.Meta):
+        db_table = 'connection_userconnectionintermediatetable_pending_requests'
+        indexes = [
+            models.Index(fields=['userconnectionintermediatetable', 'since'], name='connection_pending_since_idx'),
+            models.Index(fields=['userconnectionintermediatetable', 'username'], name='connection_pending_name_idx'),
+        ]
+
+
+class Block(models.Model):
+    """
+    Represents one user blocking another.
+
+    A block hides both users from each other in search results and friend
+    lists, and prevents either of them from sending the other a friend request.
+
+    Attributes:
+        blocker (User): The user who created the block.
+        blocked (User): The user who is blocked.
+        created_time (datetime): The timestamp when the block was created.
+    """
+    blocker = models.ForeignKey(User, related_name='blocking', on_delete=models.CASCADE)
+    blocked = models.ForeignKey(User, related_name='blocked_by', on_delete=models.CASCADE)
+    created_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blocker', 'blocked'], name='unique_block'),
+        ]
+        indexes = [
+            # The unique constraint covers lookups by blocker; this one covers
+            # the reverse direction so the anti-join is indexed both ways.
+            models.Index(fields=['blocked', 'blocker'], name='block_blocked_blocker_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.blocker.username} blocked {self.blocked.username}"
+
+class ConnectionEdge(models.Model):
+    """
+    Represents one direction of a connection, stored on the shard of its owner.
+
+    Every connection is written twice, once on the shard of each user, so that
+    all of a user's edges can be read from a single shard. Edges live in other
+    databases than users, hence plain id columns instead of foreign keys.
+
+    Attributes:
+        owner_id (int): The id of the user this edge belongs to, which selects the shard.
+        peer_id (int): The id of the other user.
+        relation (str): 'friends', 'sent_requests' or 'pending_requests', seen from the owner.
+        created_time (datetime): The timestamp when the edge was written.
+    """
+    RELATION_CHOICES = [
+        ('friends', 'Friends'),
+        ('sent_requests', 'Sent request'),
+        ('pending_requests', 'Pending request'),
+    ]
+
+    owner_id = models.BigIntegerField()
+    peer_id = models.BigIntegerField()
+    relation = models.CharField(max_length=16, choices=RELATION_CHOICES)
+    # Not auto_now_add, so moving an edge between shards keeps its timestamp
+    created_time = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # A pair can be friends and have a request pending at once. Also
+            # serves every read, which always filters by owner.
+            models.UniqueConstraint(fields=['owner_id', 'peer_id', 'relation'], name='unique_connection_edge'),
+        ]
+
+    def __str__(self):
+        return f"{self.owner_id} -> {self.peer_id} ({self.relation})"
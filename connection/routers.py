@@ -0,0 +1,36 @@
+from django.conf import settings
+
+
+class ConnectionShardRouter:
+    """
+    Keep ConnectionEdge on the connection shards and everything else off them.
+
+    Shard aliases are listed in CONNECTION_SHARDS. ConnectionEdge is never
+    migrated to 'default', so when the list is empty it has no table at all.
+    The sharding service always picks the shard with .using(), so reads and
+    writes are only routed here for edge instances saved without one.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_instance(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_instance(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'connection' and model_name == 'connectionedge':
+            return db in settings.CONNECTION_SHARDS
+        if db in settings.CONNECTION_SHARDS:
+            return False
+        return None
+
+    def _db_for_instance(self, model, hints):
+        from .sharding import shard_for
+
+        instance = hints.get('instance')
+        if model._meta.label_lower != 'connection.connectionedge' or instance is None:
+            return None
+        return shard_for(instance.owner_id)
@@ -0,0 +1,242 @@
+"""
+Shard-aware storage of connection edges.
+
+Moving connections off the default database starts with the friend graph
+reads: degrees of separation and search distances load friends from the
+shards (see graph.friend_loader), so their fan-out of adjacency queries no
+longer lands on 'default'. Lists and the summary still read Connection and
+the M2M tables on 'default', which stay the source of truth for writes.
+
+Each user's edges live on one shard, picked by a jump consistent hash of the
+hashed user id, so adding a shard only moves the users that now hash to it.
+A connection between two users is written as two edges, one per direction,
+on the shards of both users (a dual write). The writes run once the default
+database transaction commits, so the shards never see a change that was
+rolled back. The rebalance_connection_shards command with --sync repairs any
+write that failed. With CONNECTION_SHARDS empty, nothing is written.
+"""
+
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+import hashlib
+import logging
+from .consistency import expected_edges
+from .models import ConnectionEdge
+
+logger = logging.getLogger(__name__)
+
+
+def sharding_enabled():
+    return bool(settings.CONNECTION_SHARDS)
+
+
+def jump_hash(key, buckets):
+    """
+    Map a 64-bit key to one of a number of buckets.
+
+    Lamping and Veach's jump consistent hash: when the number of buckets grows
+    from n to n + 1, only 1/(n + 1) of the keys move, all of them to the new
+    bucket.
+
+    Args:
+        key (int): An unsigned 64-bit key.
+        buckets (int): The number of buckets.
+
+    Returns:
+        int: The bucket, between 0 and buckets - 1.
+    """
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(user_id):
+    """
+    Return the database alias holding a user's edges.
+
+    The id is hashed first, so sequential ids spread evenly across shards.
+
+    Args:
+        user_id (int): The id of the user.
+
+    Returns:
+        str: The shard alias, or 'default' when sharding is disabled.
+    """
+    shards = settings.CONNECTION_SHARDS
+    if not shards:
+        return 'default'
+    key = int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'big')
+    return shards[jump_hash(key, len(shards))]
+
+
+def group_by_shard(user_ids):
+    """
+    Group user ids by the shard holding their edges.
+
+    Returns:
+        dict: The user ids of each shard alias.
+    """
+    groups = defaultdict(list)
+    for user_id in user_ids:
+        groups[shard_for(user_id)].append(user_id)
+    return groups
+
+
+def write_edges(edges):
+    """
+    Create edges on their owners' shards, skipping those already there.
+
+    Args:
+        edges (iterable): (owner_id, peer_id, relation) tuples.
+    """
+    by_shard = defaultdict(list)
+    for owner_id, peer_id, relation in edges:
+        by_shard[shard_for(owner_id)].append(ConnectionEdge(owner_id=owner_id, peer_id=peer_id, relation=relation))
+    for alias, rows in by_shard.items():
+        with transaction.atomic(using=alias):
+            ConnectionEdge.objects.using(alias).bulk_create(rows, ignore_conflicts=True)
+
+
+def delete_edges(edges):
+    """
+    Delete edges from their owners' shards.
+
+    Only the given relation of each pair is deleted, so removing a request
+    never takes a friendship of the same pair with it.
+
+    Args:
+        edges (iterable): (owner_id, peer_id, relation) tuples.
+    """
+    by_shard = defaultdict(lambda: defaultdict(list))
+    for owner_id, peer_id, relation in edges:
+        by_shard[shard_for(owner_id)][owner_id, relation].append(peer_id)
+    for alias, peers in by_shard.items():
+        condition = Q()
+        for (owner_id, relation), peer_ids in peers.items():
+            condition |= Q(owner_id=owner_id, relation=relation, peer_id__in=peer_ids)
+        with transaction.atomic(using=alias):
+            ConnectionEdge.objects.using(alias).filter(condition).delete()
+
+
+def replace_requests_with_friends(pairs):
+    """
+    Turn the request edges of accepted connections into friends edges.
+
+    Args:
+        pairs (list): (from_user_id, to_user_id) tuples.
+    """
+    delete_edges(
+        edge for from_user_id, to_user_id in pairs
+        for edge in ((from_user_id, to_user_id, 'sent_requests'), (to_user_id, from_user_id, 'pending_requests'))
+    )
+    write_edges(
+        edge for from_user_id, to_user_id in pairs
+        for edge in ((from_user_id, to_user_id, 'friends'), (to_user_id, from_user_id, 'friends'))
+    )
+
+
+def _after_commit(write, *args):
+    if not sharding_enabled():
+        return
+
+    def run():
+        try:
+            write(*args)
+        except Exception:
+            # The default database stays the source of truth, a backfill repairs the shards
+            logger.exception('Connection shard write failed')
+
+    transaction.on_commit(run)
+
+
+def record_requests(pairs):
+    """
+    Dual-write sent friend requests once the current transaction commits.
+
+    Args:
+        pairs (iterable): (from_user_id, to_user_id) tuples.
+    """
+    edges = []
+    for from_user_id, to_user_id in pairs:
+        edges.append((from_user_id, to_user_id, 'sent_requests'))
+        edges.append((to_user_id, from_user_id, 'pending_requests'))
+    _after_commit(write_edges, edges)
+
+
+def record_friendships(pairs):
+    """
+    Dual-write accepted friend requests once the current transaction commits.
+
+    Args:
+        pairs (iterable): (from_user_id, to_user_id) tuples.
+    """
+    _after_commit(replace_requests_with_friends, list(pairs))
+
+
+def record_removals(pairs):
+    """
+    Delete both directions of rejected, expired or cancelled friend requests
+    once the current transaction commits. Friendships of the same pairs stay.
+
+    Args:
+        pairs (iterable): (from_user_id, to_user_id) tuples.
+    """
+    edges = []
+    for from_user_id, to_user_id in pairs:
+        edges.append((from_user_id, to_user_id, 'sent_requests'))
+        edges.append((to_user_id, from_user_id, 'pending_requests'))
+    _after_commit(delete_edges, edges)
+
+
+def load_friend_ids(user_ids):
+    """
+    Load the friends of a set of users with one query per shard involved.
+
+    Args:
+        user_ids (iterable): The ids of the users whose friends are loaded.
+
+    Returns:
+        set: The ids of every friend of at least one of the given users.
+    """
+    friend_ids = set()
+    for alias, owner_ids in group_by_shard(user_ids).items():
+        friend_ids.update(
+            ConnectionEdge.objects.using(alias)
+            .filter(owner_id__in=owner_ids, relation='friends')
+            .values_list('peer_id', flat=True)
+        )
+    return friend_ids
+
+
+def sync_range(start, end):
+    """
+    Make the edges of the owners in [start, end) match Connection.
+
+    Args:
+        start (int): The lowest owner id included.
+        end (int): The owner id at which the range stops.
+
+    Returns:
+        tuple: The number of edges written and deleted.
+    """
+    expected = {
+        (owner_id, peer_id, relation)
+        for relation in ('sent_requests', 'pending_requests', 'friends')
+        for owner_id, peer_id in expected_edges(relation, start, end)
+    }
+
+    actual = set()
+    for alias in settings.CONNECTION_SHARDS:
+        edges = ConnectionEdge.objects.using(alias).filter(owner_id__gte=start, owner_id__lt=end)
+        actual.update(edges.values_list('owner_id', 'peer_id', 'relation'))
+
+    missing = expected - actual
+    extra = actual - expected
+    delete_edges(extra)
+    write_edges(missing)
+    return len(missing), len(extra)
@@ -0,0 +1,36 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .models import Block, UserConnectionIntermediateTable
+from .versions import bump_versions
+
+
+@receiver(m2m_changed, sender=UserConnectionIntermediateTable.friends.through)
+@receiver(m2m_changed, sender=UserConnectionIntermediateTable.sent_requests.through)
+@receiver(m2m_changed, sender=UserConnectionIntermediateTable.pending_requests.through)
+def connection_lists_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Bump the connection versions of the users whose lists changed.
+    """
+    if reverse and action == 'pre_clear':
+        # A clear names no rows, so the owners listing the user are looked up before they go
+        owners = sender.objects.filter(user_id=instance.pk).values_list('userconnectionintermediatetable__user_id',
+                                                                         flat=True)
+        bump_versions([instance.pk, *owners])
+        return
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance is a user listed in other users' tables
+        owners = UserConnectionIntermediateTable.objects.filter(id__in=pk_set or ()).values_list('user_id', flat=True)
+        bump_versions([instance.pk, *owners])
+    else:
+        bump_versions([instance.user_id, *(pk_set or ())])
+
+
+@receiver(post_save, sender=Block)
+@receiver(post_delete, sender=Block)
+def block_changed(sender, instance, **kwargs):
+    """
+    Bump the connection versions of both users, as blocks filter their lists.
+    """
+    bump_versions([instance.blocker_id, instance.blocked_id])
@@ -0,0 +1,73 @@
+"""
+Collapse identical concurrent calls into a single execution.
+
+When a client fires the same read several times at once, for instance on app
+launch or when retrying, only the first call runs. The others wait for it and
+share its result, so the database sees one query however many duplicates
+arrive. A call only coalesces with one already in flight, so nothing is
+cached and a result can never be served once its call has finished.
+
+This needs concurrent requests within one process, that is threaded or
+asynchronous workers. gunicorn.conf.py uses gthread workers for that;
+with sync workers (or GUNICORN_THREADS=1) every call runs on its own.
+"""
+
+import threading
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    A group of calls keyed by what makes them identical.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """
+        Run function, unless a call with the same key is already running.
+
+        Args:
+            key (hashable): Identifies identical calls.
+            function (callable): Computes the result, without arguments.
+
+        Returns:
+            tuple: The result and whether it was shared with another caller.
+                   The result must not be mutated, as callers share it.
+
+        Raises:
+            Exception: Whatever function raised, in every caller that waited for it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = function()
+            except Exception as error:
+                call.error = error
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader or call.waiters > 0
@@ -0,0 +1,349 @@
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Connection
+import json
+import mmap
+import os
+import re
+
+MANIFEST = 'manifest.json'
+ITEM_SIZE = array('q').itemsize
+SNAPSHOT_FILE = re.compile(r'^(offsets|neighbors)-(\d+)\.bin$')
+
+
+class GraphSnapshot:
+    """
+    A read-only view of the friendship graph stored in compressed sparse row form.
+
+    The neighbors of user u are neighbors[offsets[u]:offsets[u + 1]]. Both
+    arrays are memory-mapped read-only, so every worker process on a host
+    shares the same physical pages and lookups never copy the arrays.
+
+    Attributes:
+        directory (Path): The directory holding the snapshot files.
+        manifest (dict): The metadata of the snapshot.
+        offsets (memoryview): The start of each user's neighbors, indexed by user id.
+        neighbors (memoryview): The neighbor ids of all users, back to back.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            self.manifest = json.load(manifest)
+        self.offsets = self._map(self.manifest['offsets'])
+        self.neighbors = self._map(self.manifest['neighbors'])
+
+    def _map(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(array('q'))
+            # The mapping stays valid after the file is closed
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast('q')
+
+    @property
+    def node_count(self):
+        return len(self.offsets) - 1
+
+    def friend_ids(self, user_id):
+        """
+        Return the friends of a user without copying them.
+
+        Args:
+            user_id (int): The id of the user.
+
+        Returns:
+            memoryview: The ids of the user's friends, in no particular order.
+        """
+        if not 0 <= user_id < self.node_count:
+            return self.neighbors[0:0]
+        return self.neighbors[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    def load_friend_ids(self, user_ids):
+        """
+        Return the friends of a set of users, like graph.load_friend_ids.
+
+        Args:
+            user_ids (iterable): The ids of the users whose friends are loaded.
+
+        Returns:
+            set: The ids of every friend of at least one of the given users.
+        """
+        found = set()
+        for user_id in user_ids:
+            found.update(self.friend_ids(user_id))
+        return found
+
+
+_snapshot = None
+_snapshot_mtime = None
+
+
+def get_snapshot():
+    """
+    Return the snapshot configured by GRAPH_SNAPSHOT_DIR, mapping it on first use.
+
+    The snapshot is reopened when its manifest is replaced by a rebuild, so
+    long-running workers pick up refreshed snapshots.
+
+    Returns:
+        GraphSnapshot or None: The snapshot, or None if none is configured or built.
+    """
+    global _snapshot, _snapshot_mtime
+    directory = settings.GRAPH_SNAPSHOT_DIR
+    if not directory:
+        return None
+    try:
+        mtime = os.stat(os.path.join(directory, MANIFEST)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _snapshot is None or _snapshot_mtime != mtime or str(_snapshot.directory) != str(directory):
+        _snapshot = GraphSnapshot(directory)
+        _snapshot_mtime = mtime
+    return _snapshot
+
+
+@contextmanager
+def consistent_read():
+    """
+    Run the queries of a build or refresh against a single state of the database.
+
+    The degrees and the edges of a build are read by separate queries, so a
+    connection accepted or deleted between them would make the edges overrun
+    or underfill the slots the degrees reserved. Inside one transaction,
+    SQLite and MySQL (whose default is REPEATABLE READ) already read from a
+    single snapshot. PostgreSQL defaults to READ COMMITTED and is switched to
+    REPEATABLE READ. When the caller already opened a transaction, its
+    isolation level applies.
+    """
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost and connection.vendor in ('postgresql', 'mysql'):
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        yield
+
+
+def accepted_connections(accepted_until):
+    """
+    Return the connections a snapshot taken at accepted_until contains.
+    """
+    return Connection.objects.filter(
+        Q(accepted_time__lte=accepted_until) | Q(accepted_time__isnull=True), accepted=True,
+    )
+
+
+def build_snapshot(directory, chunk_size=10000):
+    """
+    Export every accepted connection into a new snapshot.
+
+    Degrees are computed by the database first, so the offsets are known
+    before the edges are streamed straight into a memory-mapped neighbors
+    file. Memory use is therefore bounded by the offsets array. Both reads
+    run in one consistent_read(), so they see the same connections.
+
+    Args:
+        directory (str): The directory the snapshot is written to.
+        chunk_size (int): The number of connections fetched per round trip.
+
+    Returns:
+        dict: The manifest of the new snapshot.
+    """
+    with consistent_read():
+        accepted_until = timezone.now()
+        accepted = accepted_connections(accepted_until)
+        degrees = {}
+        for column in ('from_user_id', 'to_user_id'):
+            for user_id, degree in accepted.values_list(column).annotate(degree=Count('id')).order_by():
+                degrees[user_id] = degrees.get(user_id, 0) + degree
+
+        node_count = max(degrees, default=-1) + 1
+        offsets = array('q', bytes(ITEM_SIZE * (node_count + 1)))
+        for user_id in range(node_count):
+            offsets[user_id + 1] = offsets[user_id] + degrees.get(user_id, 0)
+        del degrees
+
+        version, offsets_name, neighbors_name = _next_files(directory)
+        position = array('q', offsets)
+        checksum = 0
+        with _NeighborsWriter(os.path.join(directory, neighbors_name), offsets[-1]) as neighbors:
+            for from_user_id, to_user_id in accepted.values_list('from_user_id', 'to_user_id').iterator(chunk_size=chunk_size):
+                neighbors[position[from_user_id]] = to_user_id
+                position[from_user_id] += 1
+                neighbors[position[to_user_id]] = from_user_id
+                position[to_user_id] += 1
+                checksum += from_user_id + to_user_id
+
+    # Every slot reserved by the degrees must have been filled exactly
+    if position[:-1] != offsets[1:]:
+        raise RuntimeError('The connections changed while the snapshot was built.')
+
+    return _publish(directory, version, offsets, offsets_name, neighbors_name, accepted_until, checksum)
+
+
+def checksum_of(connections):
+    """
+    Return the number of connections and the sum of their users' ids.
+
+    A removed connection lowers the count, and one removed while another was
+    missed by the refresh overlap still changes the sum, unless both
+    connections' ids add up to the same total.
+    """
+    totals = connections.aggregate(edges=Count('id'), checksum=Sum(F('from_user_id') + F('to_user_id')))
+    return totals['edges'], totals['checksum'] or 0
+
+
+def refresh_snapshot(directory):
+    """
+    Apply the connections accepted since the current snapshot was built.
+
+    The delta is read through the accepted_time index. accepted_time is set
+    before the accepting transaction commits, so the delta starts
+    GRAPH_SNAPSHOT_REFRESH_OVERLAP_SECONDS before the previous watermark, and
+    edges already in the snapshot are skipped. Runs of users without new
+    friends are copied from the current snapshot in bulk, and the result is
+    published as a new snapshot next to the old one.
+
+    Removals cannot be applied incrementally. When the number of accepted
+    connections or the sum of their users' ids differs from the snapshot's
+    plus the delta's, because a connection was removed or committed too late
+    for the overlap window, a full build is run instead. Snapshots built
+    before the sum was recorded are rebuilt once.
+
+    Args:
+        directory (str): The directory holding the current snapshot.
+
+    Returns:
+        dict: The manifest of the new snapshot, or None if nothing was accepted since.
+    """
+    current = GraphSnapshot(directory)
+    accepted_since = parse_datetime(current.manifest['accepted_until'])
+    overlap = timedelta(seconds=settings.GRAPH_SNAPSHOT_REFRESH_OVERLAP_SECONDS)
+
+    with consistent_read():
+        accepted_until = timezone.now()
+        delta = Connection.objects.filter(
+            accepted=True, accepted_time__gt=accepted_since - overlap, accepted_time__lte=accepted_until,
+        ).values_list('from_user_id', 'to_user_id')
+
+        added = {}
+        added_edges = 0
+        added_checksum = 0
+        for from_user_id, to_user_id in delta.iterator():
+            if to_user_id in current.friend_ids(from_user_id) or to_user_id in added.get(from_user_id, ()):
+                continue
+            added.setdefault(from_user_id, []).append(to_user_id)
+            added.setdefault(to_user_id, []).append(from_user_id)
+            added_edges += 1
+            added_checksum += from_user_id + to_user_id
+        edge_count, checksum = checksum_of(accepted_connections(accepted_until))
+
+    if (current.manifest.get('checksum') is None or edge_count != current.manifest['edges'] + added_edges
+            or checksum != current.manifest['checksum'] + added_checksum):
+        del current
+        return build_snapshot(directory)
+    if not added:
+        return None
+
+    old_count = current.node_count
+    node_count = max(old_count, max(added) + 1)
+    offsets = array('q', bytes(ITEM_SIZE * (node_count + 1)))
+    shift = 0
+    for user_id in range(node_count):
+        if user_id < old_count:
+            offsets[user_id] = current.offsets[user_id] + shift
+        else:
+            offsets[user_id] = current.offsets[old_count] + shift
+        shift += len(added.get(user_id, ()))
+    offsets[node_count] = current.offsets[old_count] + shift
+
+    version, offsets_name, neighbors_name = _next_files(directory)
+    with _NeighborsWriter(os.path.join(directory, neighbors_name), offsets[-1]) as neighbors:
+        copied = 0
+        written = 0
+        for user_id in sorted(added):
+            # Copy the old neighbors of every user up to and including this one
+            end = current.offsets[min(user_id + 1, old_count)]
+            neighbors[written:written + end - copied] = current.neighbors[copied:end]
+            written += end - copied
+            copied = end
+            new = added[user_id]
+            neighbors[written:written + len(new)] = array('q', new)
+            written += len(new)
+        end = current.offsets[old_count]
+        neighbors[written:written + end - copied] = current.neighbors[copied:end]
+
+    manifest = _publish(directory, version, offsets, offsets_name, neighbors_name, accepted_until, checksum)
+    del current
+    return manifest
+
+
+def _next_files(directory):
+    os.makedirs(directory, exist_ok=True)
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            version = json.load(manifest)['version'] + 1
+    except FileNotFoundError:
+        version = 1
+    return version, f'offsets-{version}.bin', f'neighbors-{version}.bin'
+
+
+def _publish(directory, version, offsets, offsets_name, neighbors_name, accepted_until, checksum):
+    with open(os.path.join(directory, offsets_name), 'wb') as f:
+        offsets.tofile(f)
+    manifest = {
+        'version': version,
+        'offsets': offsets_name,
+        'neighbors': neighbors_name,
+        'nodes': len(offsets) - 1,
+        'edges': offsets[-1] // 2,
+        'checksum': checksum,
+        'accepted_until': accepted_until.isoformat(),
+    }
+    # Swapping the manifest publishes the snapshot atomically. Workers still
+    # mapping the previous files keep reading them until they reopen.
+    path = os.path.join(directory, MANIFEST)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(f'{path}.tmp', path)
+
+    # A worker that read the previous manifest may still be about to open its
+    # files, so the previous generation is kept and only older ones are
+    # deleted. Files a worker already mapped stay readable once deleted.
+    for name in os.listdir(directory):
+        match = SNAPSHOT_FILE.match(name)
+        if match and int(match.group(2)) < version - 1:
+            os.remove(os.path.join(directory, name))
+    return manifest
+
+
+class _NeighborsWriter:
+    """
+    A writable memory map over a new neighbors file of a known length.
+    """
+
+    def __init__(self, path, length):
+        self.path = path
+        self.length = length
+
+    def __enter__(self):
+        self.file = open(self.path, 'w+b')
+        if not self.length:
+            self.map = None
+            return memoryview(array('q'))
+        self.file.truncate(self.length * ITEM_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.view = memoryview(self.map).cast('q')
+        return self.view
+
+    def __exit__(self, *exc_info):
+        if self.map is not None:
+            self.view.release()
+            self.map.flush()
+            self.map.close()
+        self.file.close()
@@ -1,9 +1,38 @@
-from django.test import TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from rest_framework.response import Response
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
-from .models import Connection, UserConnectionIntermediateTable
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+import os
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+from .accepting import accept_pending_requests
+from .blocking import blocked_user_ids
+from .consistency import diff_edges
+from .graph import degrees_of_separation, distances_from, friend_loader
+from .lists import connection_list
+from .management.commands.expire_pending_requests import Command as ExpireCommand
+from .singleflight import SingleFlight
+from . import versions
+from .versions import CONNECTIONS, bump_versions, conditional_on_version
+from .snapshot import get_snapshot
+from django.conf import settings
+from django.test import override_settings
+from django.db import connection, connections
+from .models import (ArchivedConnection, Block, Connection, ConnectionEdge, FriendEntry, PendingRequestEntry,
+                     SentRequestEntry, UserConnectionIntermediateTable)
+from .sharding import jump_hash, load_friend_ids, shard_for, write_edges
 from django.urls import reverse
+from demo_social.testing import CacheIsolatedTestCase
 
 class FriendRequestTests(TestCase):
 
@@ -121,3 +150,907 @@ class FriendRequestTests(TestCase):
         self.assertEqual(response.data['friends'][0]['id'], self.user2.id)
 
 
+class BlockTests(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        # Create users
+        self.user1 = User.objects.create_user(username='user1', password='pass', first_name='alice')
+        self.user2 = User.objects.create_user(username='user2', password='pass', first_name='alice')
+        self.user3 = User.objects.create_user(username='user3', password='pass', first_name='alice')
+
+        # Create tokens
+        for user in (self.user1, self.user2, self.user3):
+            Token.objects.create(user=user)
+
+        # Set up URLs
+        self.block_url = reverse('block_user')
+        self.unblock_url = reverse('unblock_user')
+        self.send_request_url = reverse('send_friend_request')
+        self.friends_url = reverse('check_friends')
+        self.pending_requests_url = reverse('check_pending_requests')
+        self.search_users_url = reverse('search_users')
+
+    def authenticate(self, user):
+        token = Token.objects.get(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def test_block_user(self):
+        self.authenticate(self.user1)
+        response = self.client.post(self.block_url, {'user_id': self.user2.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['message'], 'User blocked successfully.')
+        self.assertTrue(Block.objects.filter(blocker=self.user1, blocked=self.user2).exists())
+
+        # Test blocking the same user twice
+        response = self.client.post(self.block_url, {'user_id': self.user2.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'User already blocked.')
+
+        # Test blocking self
+        response = self.client.post(self.block_url, {'user_id': self.user1.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'You cannot block yourself.')
+
+    def test_unblock_user(self):
+        self.authenticate(self.user1)
+        self.client.post(self.block_url, {'user_id': self.user2.id})
+        self.assertEqual(blocked_user_ids(self.user2.id), {self.user1.id})
+
+        response = self.client.post(self.unblock_url, {'user_id': self.user2.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'User unblocked successfully.')
+        self.assertEqual(blocked_user_ids(self.user2.id), set())
+
+        # Test unblocking a user who is not blocked
+        response = self.client.post(self.unblock_url, {'user_id': self.user2.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'User is not blocked.')
+
+    def test_blocked_user_cannot_send_friend_request(self):
+        self.authenticate(self.user1)
+        self.client.post(self.block_url, {'user_id': self.user2.id})
+
+        # The block applies in both directions
+        self.authenticate(self.user2)
+        response = self.client.post(self.send_request_url, {'to_user_id': self.user1.id})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['error'], 'You cannot send a friend request to this user.')
+        self.assertFalse(Connection.objects.exists())
+
+    def test_block_cancels_pending_requests(self):
+        self.authenticate(self.user2)
+        self.client.post(self.send_request_url, {'to_user_id': self.user1.id})
+        self.authenticate(self.user1)
+        self.client.post(self.send_request_url, {'to_user_id': self.user3.id})
+
+        self.client.post(self.block_url, {'user_id': self.user2.id})
+        self.assertEqual(list(Connection.objects.values_list('from_user', 'to_user')), [(self.user1.id, self.user3.id)])
+        self.assertFalse(self.user1.connections.pending_requests.exists())
+        self.assertFalse(self.user2.connections.sent_requests.exists())
+        self.assertEqual(list(self.user1.connections.sent_requests.all()), [self.user3])
+
+    def test_blocked_user_request_cannot_be_accepted(self):
+        Connection.objects.create(from_user=self.user2, to_user=self.user1)
+        Block.objects.create(blocker=self.user2, blocked=self.user1)
+
+        self.authenticate(self.user1)
+        response = self.client.post(reverse('accept_friend_request'), {'from_user_id': self.user2.id})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['error'], 'You cannot accept a friend request from this user.')
+        self.assertFalse(Connection.objects.get().accepted)
+
+    def test_blocked_users_hidden_from_lists(self):
+        user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=self.user1)
+        user_connections.friends.add(self.user2, self.user3)
+        user_connections.pending_requests.add(self.user2)
+        Block.objects.create(blocker=self.user2, blocked=self.user1)
+
+        self.authenticate(self.user1)
+        response = self.client.get(self.friends_url)
+        self.assertEqual([friend['id'] for friend in response.data['friends']], [self.user3.id])
+
+        response = self.client.get(self.pending_requests_url)
+        self.assertEqual(response.data['pending_requests'], [])
+
+    def test_blocked_users_hidden_from_search(self):
+        Block.objects.create(blocker=self.user1, blocked=self.user2)
+
+        self.authenticate(self.user1)
+        response = self.client.get(self.search_users_url, {'keyword': 'alice'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 2)
+        self.assertEqual({user['id'] for user in response.data['results']}, {self.user1.id, self.user3.id})
+
+
+class ExpirePendingRequestsTests(TestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass')
+        self.user2 = User.objects.create_user(username='user2', password='pass')
+        self.user3 = User.objects.create_user(username='user3', password='pass')
+
+    def send_request(self, from_user, to_user, days_old, accepted=False):
+        connection = Connection.objects.create(from_user=from_user, to_user=to_user, accepted=accepted)
+        Connection.objects.filter(id=connection.id).update(created_time=timezone.now() - timedelta(days=days_old))
+        if not accepted:
+            from_user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=from_user)
+            to_user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=to_user)
+            from_user_connections.sent_requests.add(to_user)
+            to_user_connections.pending_requests.add(from_user)
+        return connection
+
+    def test_expire_pending_requests(self):
+        stale = self.send_request(self.user1, self.user2, days_old=40)
+        fresh = self.send_request(self.user1, self.user3, days_old=1)
+        other = self.send_request(self.user3, self.user2, days_old=1)
+        accepted = self.send_request(self.user2, self.user3, days_old=40, accepted=True)
+
+        call_command('expire_pending_requests', ttl_days=30, batch_size=1, stdout=StringIO())
+
+        self.assertEqual(set(Connection.objects.values_list('id', flat=True)), {fresh.id, other.id, accepted.id})
+        archived = ArchivedConnection.objects.get()
+        self.assertEqual((archived.from_user, archived.to_user), (self.user1, self.user2))
+
+        # Only the mirrored rows of the expired request are removed
+        self.assertEqual(list(self.user1.connections.sent_requests.all()), [self.user3])
+        self.assertEqual(list(self.user2.connections.pending_requests.all()), [self.user3])
+
+    def test_batch_raced_away_does_not_stop_expiry(self):
+        raced = self.send_request(self.user1, self.user2, days_old=50)
+        stale = self.send_request(self.user3, self.user2, days_old=40)
+        expire_batch = ExpireCommand.expire_batch
+
+        def accept_first_batch(command, candidate_ids):
+            # The oldest request is accepted between the candidate select and the locked re-read
+            if raced.id in candidate_ids:
+                Connection.objects.filter(id=raced.id).update(accepted=True)
+            return expire_batch(command, candidate_ids)
+
+        with mock.patch.object(ExpireCommand, 'expire_batch', accept_first_batch):
+            call_command('expire_pending_requests', ttl_days=30, batch_size=1, stdout=StringIO())
+
+        self.assertEqual(list(ArchivedConnection.objects.values_list('from_user', flat=True)), [self.user3.id])
+        self.assertEqual(set(Connection.objects.values_list('id', flat=True)), {raced.id})
+        self.assertFalse(Connection.objects.filter(id=stale.id).exists())
+
+    def test_dry_run(self):
+        self.send_request(self.user1, self.user2, days_old=40)
+        out = StringIO()
+
+        call_command('expire_pending_requests', ttl_days=30, dry_run=True, stdout=out)
+
+        self.assertIn('1 pending requests', out.getvalue())
+        self.assertEqual(Connection.objects.count(), 1)
+        self.assertFalse(ArchivedConnection.objects.exists())
+
+
+class ConnectionGraphConsistencyTests(TestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass')
+        self.user2 = User.objects.create_user(username='user2', password='pass')
+        self.user3 = User.objects.create_user(username='user3', password='pass')
+
+    def test_diff_edges(self):
+        expected = [(1, 2), (1, 2), (1, 3), (2, 1)]
+        actual = [(1, 3, 10), (2, 1, 11), (2, 3, 12)]
+        self.assertEqual(list(diff_edges(expected, actual)), [
+            ('missing', (1, 2), None),
+            ('extra', (2, 3), 12),
+        ])
+
+    def test_check_and_repair(self):
+        # An accepted connection whose friends rows were never written
+        accepted = Connection.objects.create(from_user=self.user1, to_user=self.user2, accepted=True)
+        # A pending entry left behind by a deleted request
+        user3_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=self.user3)
+        user3_connections.pending_requests.add(self.user1)
+
+        out = StringIO()
+        call_command('check_connection_graph', chunk_size=2, stdout=out)
+        self.assertIn('friends: 2 missing, 0 extra', out.getvalue())
+        self.assertIn('pending_requests: 0 missing, 1 extra', out.getvalue())
+        self.assertFalse(self.user1.friends.exists())
+
+        call_command('check_connection_graph', chunk_size=2, repair=True, stdout=StringIO())
+        self.assertEqual(list(self.user1.connections.friends.all()), [self.user2])
+        self.assertEqual(list(self.user2.connections.friends.all()), [self.user1])
+        # The recreated entries keep when the friendship started
+        self.assertEqual(set(FriendEntry.objects.values_list('since', flat=True)), {accepted.created_time})
+        self.assertFalse(user3_connections.pending_requests.exists())
+
+        out = StringIO()
+        call_command('check_connection_graph', stdout=out)
+        self.assertIn('Connection tables are consistent.', out.getvalue())
+
+    def test_resume_from_checkpoint(self):
+        Connection.objects.create(from_user=self.user1, to_user=self.user2)
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+            with open(checkpoint, 'w') as f:
+                f.write('{"next_user_id": %d}' % (self.user3.id + 1))
+
+            out = StringIO()
+            call_command('check_connection_graph', checkpoint=checkpoint, stdout=out)
+            self.assertIn('Connection tables are consistent.', out.getvalue())
+            self.assertFalse(os.path.exists(checkpoint))
+
+
+# Friends are only written to the default database here, so it is read instead of the shards
+@override_settings(CONNECTION_SHARDS=[])
+class ConnectionDistanceTests(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        # Create a chain of friends: user0 - user1 - user2 - user3 - user4
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(5)]
+        for user, friend in zip(self.users, self.users[1:]):
+            UserConnectionIntermediateTable.objects.get_or_create(user=user)[0].friends.add(friend)
+            UserConnectionIntermediateTable.objects.get_or_create(user=friend)[0].friends.add(user)
+
+        token = Token.objects.create(user=self.users[0])
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.distance_url = reverse('connection_distance')
+
+    def test_degrees_of_separation(self):
+        # A line graph 0 - 1 - ... - 9 plus a shortcut 0 - 5
+        graph = {i: {i - 1, i + 1} & set(range(10)) for i in range(10)}
+        graph[0].add(5)
+        graph[5].add(0)
+        load_neighbors = lambda user_ids: set().union(*(graph[user_id] for user_id in user_ids))
+
+        self.assertEqual(degrees_of_separation(0, 0, 3, 100, load_neighbors), 0)
+        self.assertEqual(degrees_of_separation(0, 1, 3, 100, load_neighbors), 1)
+        self.assertEqual(degrees_of_separation(0, 7, 3, 100, load_neighbors), 3)
+        self.assertEqual(degrees_of_separation(7, 0, 3, 100, load_neighbors), 3)
+        self.assertIsNone(degrees_of_separation(0, 8, 3, 100, load_neighbors))
+        self.assertIsNone(degrees_of_separation(0, 7, 3, 1, load_neighbors))
+        self.assertEqual(distances_from(0, [0, 4, 6, 9], 3, 100, load_neighbors), {0: 0, 4: 2, 6: 2, 9: None})
+
+    def test_connection_distance(self):
+        blocked_user_ids(self.users[0].id)
+        for user, distance in zip(self.users[1:], [1, 2, 3, None]):
+            # Token and user lookups, then one query per level of the search
+            with self.assertNumQueries(2 + (distance or 3)):
+                response = self.client.get(self.distance_url, {'user_id': user.id})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, {'user_id': user.id, 'distance': distance})
+
+    def test_connection_distance_unknown_user(self):
+        response = self.client.get(self.distance_url, {'user_id': 0})
+        self.assertEqual(response.status_code, 404)
+
+
+class GraphSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(4)]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def friends_in_snapshot(self, user):
+        return sorted(get_snapshot().friend_ids(user.id))
+
+    def test_build_and_refresh_snapshot(self):
+        user0, user1, user2, user3 = self.users
+        Connection.objects.create(from_user=user0, to_user=user1, accepted=True)
+        Connection.objects.create(from_user=user1, to_user=user2, accepted=True)
+        Connection.objects.create(from_user=user2, to_user=user3)
+
+        with override_settings(GRAPH_SNAPSHOT_DIR=self.directory):
+            call_command('build_graph_snapshot', stdout=StringIO())
+            self.assertEqual(get_snapshot().manifest['edges'], 2)
+            self.assertEqual(self.friends_in_snapshot(user1), [user0.id, user2.id])
+            self.assertEqual(self.friends_in_snapshot(user3), [])
+
+            # Accept the pending request and befriend a brand new user
+            Connection.objects.filter(from_user=user2, to_user=user3).update(accepted=True, accepted_time=timezone.now())
+            user4 = User.objects.create_user(username='user4', password='pass')
+            Connection.objects.create(from_user=user4, to_user=user0, accepted=True, accepted_time=timezone.now())
+
+            call_command('build_graph_snapshot', incremental=True, stdout=StringIO())
+            self.assertEqual(get_snapshot().manifest['version'], 2)
+            self.assertEqual(get_snapshot().manifest['edges'], 4)
+            self.assertEqual(self.friends_in_snapshot(user0), sorted([user1.id, user4.id]))
+            self.assertEqual(self.friends_in_snapshot(user1), [user0.id, user2.id])
+            self.assertEqual(self.friends_in_snapshot(user3), [user2.id])
+            self.assertEqual(self.friends_in_snapshot(user4), [user0.id])
+
+            out = StringIO()
+            call_command('build_graph_snapshot', incremental=True, stdout=out)
+            self.assertIn('Snapshot is up to date.', out.getvalue())
+
+            # Only the current and previous generations are kept
+            self.assertEqual(sorted(name for name in os.listdir(self.directory) if name.endswith('.bin')),
+                             ['neighbors-1.bin', 'neighbors-2.bin', 'offsets-1.bin', 'offsets-2.bin'])
+
+    def test_refresh_picks_up_late_commits_and_rebuilds_on_removals(self):
+        user0, user1, user2, user3 = self.users
+        Connection.objects.create(from_user=user0, to_user=user1, accepted=True)
+        removed = Connection.objects.create(from_user=user1, to_user=user2, accepted=True)
+
+        with override_settings(GRAPH_SNAPSHOT_DIR=self.directory):
+            call_command('build_graph_snapshot', stdout=StringIO())
+
+            # Stamped before the build's watermark, but committed after it
+            watermark = parse_datetime(get_snapshot().manifest['accepted_until'])
+            Connection.objects.create(from_user=user2, to_user=user3, accepted=True,
+                                      accepted_time=watermark - timedelta(seconds=1))
+            call_command('build_graph_snapshot', incremental=True, stdout=StringIO())
+            self.assertEqual(self.friends_in_snapshot(user3), [user2.id])
+
+            # A removal cannot be applied incrementally and triggers a full build
+            removed.delete()
+            call_command('build_graph_snapshot', incremental=True, stdout=StringIO())
+            self.assertEqual(get_snapshot().manifest['edges'], 2)
+            self.assertEqual(self.friends_in_snapshot(user1), [user0.id])
+            self.assertEqual(self.friends_in_snapshot(user2), [user3.id])
+
+    def test_refresh_rebuilds_when_a_removal_hides_behind_a_missed_connection(self):
+        user0, user1, user2, user3 = self.users
+        Connection.objects.create(from_user=user0, to_user=user1, accepted=True)
+        removed = Connection.objects.create(from_user=user1, to_user=user2, accepted=True)
+
+        with override_settings(GRAPH_SNAPSHOT_DIR=self.directory):
+            call_command('build_graph_snapshot', stdout=StringIO())
+
+            # The count stays at two, only the sum of the users' ids tells the difference
+            removed.delete()
+            watermark = parse_datetime(get_snapshot().manifest['accepted_until'])
+            Connection.objects.create(from_user=user0, to_user=user2, accepted=True,
+                                      accepted_time=watermark - timedelta(days=1))
+            call_command('build_graph_snapshot', incremental=True, stdout=StringIO())
+            self.assertEqual(get_snapshot().manifest['edges'], 2)
+            self.assertEqual(self.friends_in_snapshot(user0), [user1.id, user2.id])
+            self.assertEqual(self.friends_in_snapshot(user1), [user0.id])
+
+    def test_distance_uses_snapshot(self):
+        user0, user1, user2, user3 = self.users
+        Connection.objects.create(from_user=user0, to_user=user1, accepted=True)
+        Connection.objects.create(from_user=user1, to_user=user2, accepted=True)
+
+        with override_settings(GRAPH_SNAPSHOT_DIR=self.directory):
+            call_command('build_graph_snapshot', stdout=StringIO())
+            # The friends M2M table is empty, so the path can only come from the snapshot
+            client = APIClient()
+            token = Token.objects.create(user=user0)
+            client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+            response = client.get(reverse('connection_distance'), {'user_id': user2.id})
+            self.assertEqual(response.data['distance'], 2)
+
+
+class ConditionalGetTests(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        self.user1 = User.objects.create_user(username='user1', password='pass')
+        self.user2 = User.objects.create_user(username='user2', password='pass')
+        self.user3 = User.objects.create_user(username='user3', password='pass')
+        for user in (self.user1, self.user2, self.user3):
+            Token.objects.create(user=user)
+        self.friends_url = reverse('check_friends')
+        self.pending_requests_url = reverse('check_pending_requests')
+
+    def authenticate(self, user):
+        token = Token.objects.get(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def test_not_modified(self):
+        self.authenticate(self.user1)
+        response = self.client.get(self.friends_url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # Only the token is looked up in the database
+        with self.assertNumQueries(1):
+            response = self.client.get(self.friends_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        # Lists of different users never share ETags
+        self.authenticate(self.user2)
+        response = self.client.get(self.friends_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_connection_transitions_change_etag(self):
+        self.authenticate(self.user2)
+        etag = self.client.get(self.pending_requests_url)['ETag']
+
+        self.authenticate(self.user1)
+        self.client.post(reverse('send_friend_request'), {'to_user_id': self.user2.id})
+
+        self.authenticate(self.user2)
+        response = self.client.get(self.pending_requests_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['pending_requests']), 1)
+        etag = response['ETag']
+
+        self.client.post(reverse('accept_friend_request'), {'from_user_id': self.user1.id})
+        response = self.client.get(self.pending_requests_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pending_requests'], [])
+
+    def test_block_and_name_changes_change_etag(self):
+        UserConnectionIntermediateTable.objects.create(user=self.user1).friends.add(self.user2, self.user3)
+        self.authenticate(self.user1)
+        etag = self.client.get(self.friends_url)['ETag']
+
+        self.user2.username = 'renamed'
+        self.user2.save()
+        response = self.client.get(self.friends_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('renamed', [friend['username'] for friend in response.data['friends']])
+        etag = response['ETag']
+
+        self.user3.last_name = 'Smith'
+        self.user3.save(update_fields=['last_name'])
+        response = self.client.get(self.friends_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Smith', [friend['last_name'] for friend in response.data['friends']])
+        etag = response['ETag']
+
+        Block.objects.create(blocker=self.user3, blocked=self.user1)
+        response = self.client.get(self.friends_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['friends']), 1)
+
+    def test_cascades_and_clears_change_etag(self):
+        UserConnectionIntermediateTable.objects.create(user=self.user1).friends.add(self.user2, self.user3)
+        self.authenticate(self.user1)
+        etag = self.client.get(self.friends_url)['ETag']
+
+        # Deleting a user removes them from other users' lists by cascade
+        self.user2.delete()
+        response = self.client.get(self.friends_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([friend['username'] for friend in response.data['friends']], ['user3'])
+        etag = response['ETag']
+
+        # Clearing from the listed user's side
+        self.user3.friends.clear()
+        response = self.client.get(self.friends_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['friends'], [])
+
+
+class EdgeRoutingTests(TestCase):
+
+    def test_edges_never_migrated_to_default(self):
+        self.assertNotIn('connection_connectionedge', connections['default'].introspection.table_names())
+
+
+@skipUnless(settings.CONNECTION_SHARDS, 'run with --settings=demo_social.settings_test')
+class ConnectionShardingTests(CacheIsolatedTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        self.user1 = User.objects.create_user(username='user1', password='pass')
+        # A second user whose edges live on the other shard
+        self.user2 = User.objects.create_user(username='user2', password='pass')
+        while shard_for(self.user2.id) == shard_for(self.user1.id):
+            self.user2.delete()
+            self.user2 = User.objects.create_user(username='user2', password='pass')
+        self.token1 = Token.objects.create(user=self.user1)
+        self.token2 = Token.objects.create(user=self.user2)
+
+    def edges(self):
+        return {
+            alias: set(ConnectionEdge.objects.using(alias).values_list('owner_id', 'peer_id', 'relation'))
+            for alias in settings.CONNECTION_SHARDS
+        }
+
+    def test_edges_only_migrated_to_shards(self):
+        for alias in settings.CONNECTION_SHARDS:
+            tables = connections[alias].introspection.table_names()
+            self.assertIn('connection_connectionedge', tables)
+            self.assertNotIn('auth_user', tables)
+
+    def test_jump_hash_only_moves_keys_to_new_shard(self):
+        moved = 0
+        for key in range(0, 10 ** 19, 10 ** 16):
+            before, after = jump_hash(key, 3), jump_hash(key, 4)
+            if before != after:
+                self.assertEqual(after, 3)
+                moved += 1
+        self.assertAlmostEqual(moved / 1000, 1 / 4, delta=0.05)
+
+    def test_connection_is_dual_written_on_both_shards(self):
+        shard1, shard2 = shard_for(self.user1.id), shard_for(self.user2.id)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('send_friend_request'), {'to_user_id': self.user2.id})
+        edges = self.edges()
+        self.assertEqual(edges[shard1], {(self.user1.id, self.user2.id, 'sent_requests')})
+        self.assertEqual(edges[shard2], {(self.user2.id, self.user1.id, 'pending_requests')})
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token2.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('accept_friend_request'), {'from_user_id': self.user1.id})
+        edges = self.edges()
+        self.assertEqual(edges[shard1], {(self.user1.id, self.user2.id, 'friends')})
+        self.assertEqual(edges[shard2], {(self.user2.id, self.user1.id, 'friends')})
+        self.assertEqual(load_friend_ids([self.user1.id, self.user2.id]), {self.user1.id, self.user2.id})
+
+    def test_accept_all_is_dual_written(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('send_friend_request'), {'to_user_id': self.user2.id})
+        # A request in return, deleted by the acceptance
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token2.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('send_friend_request'), {'to_user_id': self.user1.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            accept_pending_requests(self.user2)
+        self.assertEqual(self.edges(), {
+            shard_for(self.user1.id): {(self.user1.id, self.user2.id, 'friends')},
+            shard_for(self.user2.id): {(self.user2.id, self.user1.id, 'friends')},
+        })
+
+    def test_rejected_request_is_removed_from_both_shards(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('send_friend_request'), {'to_user_id': self.user2.id})
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token2.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('reject_friend_request'), {'from_user_id': self.user1.id})
+        self.assertEqual(sum(map(len, self.edges().values())), 0)
+
+    def test_rejected_reverse_request_keeps_friendship(self):
+        shard1, shard2 = shard_for(self.user1.id), shard_for(self.user2.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('send_friend_request'), {'to_user_id': self.user2.id})
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token2.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('accept_friend_request'), {'from_user_id': self.user1.id})
+
+        # A request between friends is stored next to the friendship
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('send_friend_request'), {'to_user_id': self.user1.id})
+        self.assertEqual(self.edges()[shard1], {(self.user1.id, self.user2.id, 'friends'),
+                                                (self.user1.id, self.user2.id, 'pending_requests')})
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('reject_friend_request'), {'from_user_id': self.user2.id})
+        self.assertEqual(self.edges(), {
+            shard1: {(self.user1.id, self.user2.id, 'friends')},
+            shard2: {(self.user2.id, self.user1.id, 'friends')},
+        })
+
+    def test_distance_reads_friends_from_shards(self):
+        self.assertIs(friend_loader(), load_friend_ids)
+
+        # Friends only on the shards, not in the default database
+        write_edges([(self.user1.id, self.user2.id, 'friends'), (self.user2.id, self.user1.id, 'friends')])
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        response = self.client.get(reverse('connection_distance'), {'user_id': self.user2.id})
+        self.assertEqual(response.data['distance'], 1)
+
+    def test_rebalance_after_adding_a_shard(self):
+        edges = [(owner_id, owner_id + 1, 'friends') for owner_id in range(1, 41)]
+        with override_settings(CONNECTION_SHARDS=settings.CONNECTION_SHARDS[:1]):
+            write_edges(edges)
+
+        out = StringIO()
+        call_command('rebalance_connection_shards', '--batch-size', '7', stdout=out)
+        placed = self.edges()
+        for owner_id, peer_id, relation in edges:
+            self.assertIn((owner_id, peer_id, relation), placed[shard_for(owner_id)])
+        self.assertEqual(sum(map(len, placed.values())), len(edges))
+        self.assertTrue(placed[settings.CONNECTION_SHARDS[1]])
+
+    def test_sync_repairs_shards_from_connections(self):
+        Connection.objects.create(from_user=self.user1, to_user=self.user2, accepted=True)
+        write_edges([(self.user1.id, self.user2.id, 'sent_requests'), (self.user2.id, 999, 'friends')])
+
+        call_command('rebalance_connection_shards', '--sync', stdout=StringIO())
+        self.assertEqual(self.edges(), {
+            shard_for(self.user1.id): {(self.user1.id, self.user2.id, 'friends')},
+            shard_for(self.user2.id): {(self.user2.id, self.user1.id, 'friends')},
+        })
+
+
+class ConnectionSummaryTests(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        self.user1, self.user2, self.user3, self.user4, self.user5 = (
+            User.objects.create_user(username=f'user{number}', password='pass') for number in range(1, 6)
+        )
+        connections = UserConnectionIntermediateTable.objects.create(user=self.user1)
+        connections.friends.add(self.user2, self.user3)
+        connections.pending_requests.add(self.user4)
+        connections.sent_requests.add(self.user5)
+        Block.objects.create(blocker=self.user3, blocked=self.user1)
+
+        token = Token.objects.create(user=self.user1)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = reverse('connection_summary')
+
+    def test_summary(self):
+        # The token lookup, and one query for all three lists
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'friends': [{'id': self.user2.id, 'username': 'user2'}],
+            'pending_requests': [{'id': self.user4.id, 'username': 'user4'}],
+            'sent_requests': [{'id': self.user5.id, 'username': 'user5'}],
+            'counts': {'friends': 1, 'pending_requests': 1, 'sent_requests': 1},
+        })
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_summary_without_connections(self):
+        token = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['counts'], {'friends': 0, 'pending_requests': 0, 'sent_requests': 0})
+        self.assertFalse(UserConnectionIntermediateTable.objects.filter(user=self.user2).exists())
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_identical_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return {'value': 1}
+
+        results = []
+
+        def request():
+            results.append(flight.do(('user', '/summary/'), load))
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Let every follower reach the wait before the leader finishes
+        while flight._calls and flight._calls[('user', '/summary/')].waiters < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], [{'value': 1}] * 5)
+        self.assertTrue(all(shared for _, shared in results))
+
+        # Once finished, a call runs again
+        release.set()
+        self.assertEqual(flight.do(('user', '/summary/'), load), ({'value': 1}, False))
+        self.assertEqual(len(calls), 2)
+
+    def test_conditional_views_share_one_run(self):
+        calls = []
+        release = threading.Event()
+
+        @conditional_on_version(CONNECTIONS)
+        def view(request):
+            calls.append(1)
+            release.wait(5)
+            return Response({'friends': []})
+
+        request = RequestFactory().get('/connections/check_friends/')
+        request.user = SimpleNamespace(id=1)
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(view(request))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while len(calls) < 1 or sum(call.waiters for call in versions._flight._calls.values()) < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([response.data for response in responses], [{'friends': []}] * 3)
+        # Each caller gets its own response to render
+        self.assertEqual(len({id(response) for response in responses}), 3)
+        self.assertEqual(len({response['ETag'] for response in responses}), 1)
+
+        # A new version never shares a run started for the old one
+        bump_versions([1])
+        view(request)
+        self.assertEqual(len(calls), 2)
+
+    def test_error_raised_in_every_caller(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError('database down')
+
+        with self.assertRaises(ValueError):
+            flight.do('key', fail)
+        self.assertEqual(flight._calls, {})
+
+
+class ConnectionListOrderingTests(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        self.user = User.objects.create_user(username='owner', password='pass')
+        self.carol = User.objects.create_user(username='carol', first_name='Carol', password='pass')
+        self.alice = User.objects.create_user(username='alice', first_name='Alice', last_name='Moore', password='pass')
+        self.bob = User.objects.create_user(username='bob', first_name='Bob', password='pass')
+
+        connections = UserConnectionIntermediateTable.objects.create(user=self.user)
+        for friend in (self.carol, self.alice, self.bob):
+            accepted = Connection.objects.create(from_user=friend, to_user=self.user, accepted=True,
+                                                 accepted_time=timezone.now())
+            connections.friends.add(friend, through_defaults={'since': accepted.accepted_time})
+        for requester in (self.bob, self.alice):
+            pending = Connection.objects.create(from_user=requester, to_user=self.user)
+            connections.pending_requests.add(requester, through_defaults={'since': pending.created_time})
+
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def ids(self, url_name, relation, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        return [user['id'] for user in response.data[relation]]
+
+    def test_ordering(self):
+        self.assertEqual(self.ids('check_friends', 'friends', ordering='recent'),
+                         [self.bob.id, self.alice.id, self.carol.id])
+        FriendEntry.objects.filter(user=self.carol).update(since=timezone.now())
+        self.assertEqual(self.ids('check_friends', 'friends', ordering='recent'),
+                         [self.carol.id, self.bob.id, self.alice.id])
+        self.assertEqual(self.ids('check_friends', 'friends', ordering='name'),
+                         [self.alice.id, self.bob.id, self.carol.id])
+        self.assertEqual(self.ids('check_pending_requests', 'pending_requests', ordering='recent'),
+                         [self.alice.id, self.bob.id])
+
+    def test_name_ordering_follows_renames(self):
+        self.carol.username = 'abigail'
+        self.carol.save()
+        self.assertEqual(self.ids('check_friends', 'friends', ordering='name'),
+                         [self.carol.id, self.alice.id, self.bob.id])
+        self.carol.username = 'zoe'
+        self.carol.save(update_fields=['username'])
+        self.assertEqual(self.ids('check_friends', 'friends', ordering='name'),
+                         [self.alice.id, self.bob.id, self.carol.id])
+
+    def test_requests_record_when_they_started(self):
+        self.client.post(reverse('send_friend_request'), {'to_user_id': self.carol.id})
+        sent = Connection.objects.get(from_user=self.user, to_user=self.carol)
+        self.assertEqual(SentRequestEntry.objects.get(user=self.carol).since, sent.created_time)
+        self.assertEqual(PendingRequestEntry.objects.get(user=self.user).username, 'owner')
+
+    def test_filter(self):
+        self.assertEqual(self.ids('check_friends', 'friends', q='moo'), [self.alice.id])
+        self.assertEqual(self.ids('check_friends', 'friends', q='B', ordering='name'), [self.bob.id])
+        self.assertEqual(self.ids('check_sent_requests', 'sent_requests', q='alice'), [])
+
+    def test_since_and_names_returned(self):
+        response = self.client.get(reverse('check_pending_requests'), {'ordering': 'recent'})
+        alice = response.data['pending_requests'][0]
+        self.assertEqual(alice['first_name'], 'Alice')
+        self.assertEqual(alice['since'], Connection.objects.get(from_user=self.alice, accepted=False).created_time)
+
+    def test_unknown_ordering(self):
+        response = self.client.get(reverse('check_friends'), {'ordering': 'oldest'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], "ordering must be 'recent' or 'name'.")
+
+    def test_list_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The plans are checked in the SQLite EXPLAIN format')
+        for relation in ('friends', 'sent_requests', 'pending_requests'):
+            for ordering in (None, 'recent', 'name'):
+                for keyword in (None, 'a'):
+                    plan = connection_list(self.user, relation, ordering, keyword).explain()
+                    case = (relation, ordering, keyword)
+                    # Every table is searched through an index, none is scanned
+                    self.assertNotRegex(plan, r'\bSCAN\b', case)
+                    # Only the user's rows of the list table are read, already in the asked order
+                    self.assertRegex(plan, rf'SEARCH connection_userconnectionintermediatetable_{relation} '
+                                           rf'USING (COVERING )?INDEX \S+ \(userconnectionintermediatetable_id=\?\)',
+                                     case)
+                    self.assertNotIn('USE TEMP B-TREE', plan, case)
+                    if ordering is not None:
+                        key = {'recent': 'since', 'name': 'name'}[ordering]
+                        self.assertRegex(plan, rf'connection_{relation.split("_")[0]}_{key}_idx', case)
+
+
+class AcceptAllFriendRequestsTests(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        self.user = User.objects.create_user(username='viral', password='pass')
+        self.senders = [User.objects.create_user(username=f'fan{number}', password='pass') for number in range(8)]
+        for sender in self.senders:
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=sender).key)
+            self.client.post(reverse('send_friend_request'), {'to_user_id': self.user.id})
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = reverse('accept_all_friend_requests')
+
+    def test_accept_all(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['accepted'], 8)
+
+        user_connections = UserConnectionIntermediateTable.objects.get(user=self.user)
+        self.assertEqual(set(user_connections.friends.all()), set(self.senders))
+        self.assertFalse(user_connections.pending_requests.exists())
+        for sender in self.senders:
+            self.assertEqual(list(sender.connections.friends.all()), [self.user])
+            self.assertFalse(sender.connections.sent_requests.exists())
+        self.assertFalse(Connection.objects.filter(accepted=False).exists())
+        self.assertFalse(Connection.objects.filter(accepted_time__isnull=True).exists())
+
+        # Nothing left to accept
+        self.assertEqual(self.client.post(self.url).data['accepted'], 0)
+
+    def test_requests_in_return_are_resolved(self):
+        for sender in self.senders[:2]:
+            self.client.post(reverse('send_friend_request'), {'to_user_id': sender.id})
+
+        self.assertEqual(self.client.post(self.url).data['accepted'], 8)
+        self.assertFalse(Connection.objects.filter(accepted=False).exists())
+        self.assertEqual(Connection.objects.filter(from_user=self.user).count(), 0)
+        self.assertFalse(UserConnectionIntermediateTable.objects.get(user=self.user).sent_requests.exists())
+        for sender in self.senders[:2]:
+            self.assertFalse(sender.connections.pending_requests.exists())
+            self.assertEqual(list(sender.connections.friends.all()), [self.user])
+
+        out = StringIO()
+        call_command('check_connection_graph', stdout=out)
+        self.assertIn('Connection tables are consistent.', out.getvalue())
+
+    def test_statements_do_not_grow_with_requests(self):
+        Connection.objects.filter(from_user__in=self.senders[4:]).update(accepted=True)
+        with CaptureQueriesContext(connection) as four:
+            self.assertEqual(accept_pending_requests(self.user), 4)
+        Connection.objects.update(accepted=False)
+        with CaptureQueriesContext(connection) as eight:
+            self.assertEqual(accept_pending_requests(self.user), 8)
+        self.assertEqual(len(four), len(eight))
+
+        # Small chunks accept everything, a fixed number of statements at a time
+        Connection.objects.update(accepted=False)
+        self.assertEqual(accept_pending_requests(self.user, chunk_size=3), 8)
+
+    def test_accept_since(self):
+        old = timezone.now() - timedelta(days=2)
+        Connection.objects.filter(from_user__in=self.senders[:5]).update(created_time=old)
+        response = self.client.post(self.url, {'since': (old + timedelta(hours=1)).isoformat()})
+        self.assertEqual(response.data['accepted'], 3)
+        self.assertEqual(Connection.objects.filter(accepted=False).count(), 5)
+
+        for since in ('yesterday', 1700000000, {'date': '2024-01-01'}):
+            response = self.client.post(self.url, {'since': since}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['error'], 'since must be an ISO 8601 timestamp.')
+
+    def test_blocked_requests_stay_pending(self):
+        Block.objects.create(blocker=self.user, blocked=self.senders[0])
+        self.assertEqual(self.client.post(self.url).data['accepted'], 7)
+        self.assertFalse(Connection.objects.get(from_user=self.senders[0]).accepted)
@@ -4,8 +4,13 @@ from . import views
 urlpatterns = [
     path('send_friend_request/', views.send_friend_request, name='send_friend_request'),
     path('accept_friend_request/', views.accept_friend_request, name='accept_friend_request'),
+    path('accept_all_friend_requests/', views.accept_all_friend_requests, name='accept_all_friend_requests'),
     path('pending_requests/', views.check_pending_requests, name='check_pending_requests'),
     path('sent_requests/', views.check_sent_requests, name='check_sent_requests'),
     path('reject_friend_request/', views.reject_friend_request, name='reject_friend_request'),
     path('check_friends/', views.check_friends, name='check_friends'),
+    path('block_user/', views.block_user, name='block_user'),
+    path('unblock_user/', views.unblock_user, name='unblock_user'),
+    path('distance/', views.connection_distance, name='connection_distance'),
+    path('summary/', views.connection_summary, name='connection_summary'),
 ]
\ No newline at end of file
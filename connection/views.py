@@ -1,11 +1,21 @@
 from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
-from .models import Connection, UserConnectionIntermediateTable
+from .accepting import accept_pending_requests
+from .blocking import cancel_requests_between, invalidate_block_cache, is_blocked
+from .lists import ORDERINGS, connection_list
+from .models import Block, Connection, UserConnectionIntermediateTable
+from .sharding import record_friendships, record_removals, record_requests
+from .summary import load_summary
 from .throttling import SendFriendRequestThrottle
+from .versions import CONNECTIONS, conditional_on_version
 
 
 @api_view(['POST'])
@@ -15,7 +25,8 @@ def send_friend_request(request):
     Send a friend request from the authenticated user to another user.
 
     This view handles the creation of a friend request. It ensures that a user
-    cannot send a friend request to themselves or duplicate an existing request.
+    cannot send a friend request to themselves, to a user related to them by a
+    block, or duplicate an existing request.
     The request is also rate-limited to prevent spamming.
 
     Args:
@@ -33,6 +44,9 @@ def send_friend_request(request):
     if request.user == to_user:
         return Response({'error': 'You cannot send a friend request to yourself.'}, status=status.HTTP_400_BAD_REQUEST)
 
+    if is_blocked(request.user.id, to_user.id):
+        return Response({'error': 'You cannot send a friend request to this user.'}, status=status.HTTP_403_FORBIDDEN)
+
     connection, created = Connection.objects.get_or_create(from_user=request.user, to_user=to_user)
 
     if not created:
@@ -42,12 +56,14 @@ def send_friend_request(request):
     from_user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=request.user)
     to_user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=to_user)
 
-    from_user_connections.sent_requests.add(to_user)
-    to_user_connections.pending_requests.add(request.user)
+    from_user_connections.sent_requests.add(to_user, through_defaults={'since': connection.created_time})
+    to_user_connections.pending_requests.add(request.user, through_defaults={'since': connection.created_time})
 
     from_user_connections.save()
     to_user_connections.save()
 
+    record_requests([(request.user.id, to_user.id)])
+
     return Response({'message': 'Friend request sent successfully.'}, status=status.HTTP_201_CREATED)
 
 @api_view(['POST'])
@@ -56,7 +72,8 @@ def accept_friend_request(request):
     Accept a friend request sent to the authenticated user.
 
     This view marks a friend request as accepted and updates the
-    UserConnectionIntermediateTable for both users involved.
+    UserConnectionIntermediateTable for both users involved. A request
+    between users related by a block cannot be accepted.
 
     Args:
         request (HttpRequest): The request object containing the authenticated user token
@@ -74,7 +91,11 @@ def accept_friend_request(request):
     if connection.accepted:
         return Response({'error': 'Friend request already accepted.'}, status=status.HTTP_400_BAD_REQUEST)
 
+    if is_blocked(request.user.id, from_user.id):
+        return Response({'error': 'You cannot accept a friend request from this user.'}, status=status.HTTP_403_FORBIDDEN)
+
     connection.accepted = True
+    connection.accepted_time = timezone.now()
     connection.save()
 
     # Update UserConnectionIntermediateTable for both users
@@ -84,14 +105,51 @@ def accept_friend_request(request):
     request_user_connections.pending_requests.remove(from_user)
     from_user_connections.sent_requests.remove(request.user)
 
-    request_user_connections.friends.add(from_user)
-    from_user_connections.friends.add(request.user)
+    request_user_connections.friends.add(from_user, through_defaults={'since': connection.accepted_time})
+    from_user_connections.friends.add(request.user, through_defaults={'since': connection.accepted_time})
 
     request_user_connections.save()
     from_user_connections.save()
 
+    record_friendships([(from_user.id, request.user.id)])
+
     return Response({'message': 'Friend request accepted successfully.'}, status=status.HTTP_200_OK)
 
+@api_view(['POST'])
+def accept_all_friend_requests(request):
+    """
+    Accept every pending friend request sent to the authenticated user.
+
+    Unlike repeated calls to accept_friend_request, the requests are accepted
+    set-based, in chunks of a fixed number of statements each. Requests from
+    users related to the authenticated user by a block stay pending.
+
+    Args:
+        request (HttpRequest): The request object containing the authenticated user token
+                               and the optional 'since' (ISO 8601 timestamp) in the POST
+                               data, to only accept requests sent from that time on.
+
+    Returns:
+        Response: A Response object containing the number of requests accepted,
+                  or an error message for an invalid timestamp.
+    """
+    since = request.data.get('since')
+    if since:
+        try:
+            since = parse_datetime(since)
+        except (TypeError, ValueError):
+            # TypeError for JSON bodies sending a number or an object
+            since = None
+        if since is None:
+            return Response({'error': 'since must be an ISO 8601 timestamp.'}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+
+    accepted = accept_pending_requests(request.user, since=since or None)
+
+    return Response({'message': f'{accepted} friend requests accepted.', 'accepted': accepted},
+                    status=status.HTTP_200_OK)
+
 @api_view(['POST'])
 def reject_friend_request(request):
     """
@@ -128,65 +186,205 @@ def reject_friend_request(request):
     request_user_connections.save()
     from_user_connections.save()
 
+    record_removals([(from_user.id, request.user.id)])
+
     return Response({'message': 'Friend request rejected successfully.'}, status=status.HTTP_200_OK)
 
+def connection_list_response(request, relation):
+    """
+    Build the response of one of the friend and request list views.
+
+    Args:
+        request (HttpRequest): The request of the list view.
+        relation (str): One of 'friends', 'sent_requests' or 'pending_requests'.
+
+    Returns:
+        Response: The list, or an error message for an unknown ordering.
+    """
+    ordering = request.query_params.get('ordering')
+    if ordering is not None and ordering not in ORDERINGS:
+        return Response({'error': "ordering must be 'recent' or 'name'."}, status=status.HTTP_400_BAD_REQUEST)
+    keyword = request.query_params.get('q', '').strip()
+
+    users = [
+        {'id': user_id, 'username': username, 'first_name': first_name, 'last_name': last_name, 'since': since}
+        for user_id, username, first_name, last_name, since
+        in connection_list(request.user, relation, ordering, keyword)
+    ]
+
+    return Response({relation: users}, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
+@conditional_on_version(CONNECTIONS)
 def check_pending_requests(request):
     """
     Retrieve pending friend requests for the authenticated user.
 
     This view returns a list of pending friend requests sent to the
-    authenticated user.
+    authenticated user. The response carries an ETag, and a request with a
+    matching If-None-Match header gets a 304 without the list being queried.
 
     Args:
-        request (HttpRequest): The request object containing the authenticated user token.
+        request (HttpRequest): The request object containing the authenticated user token,
+                               and the optional 'ordering' ('recent' or 'name') and 'q'
+                               (part of a username or name) in the query parameters.
 
     Returns:
         Response: A Response object containing a list of pending friend requests.
     """
-    user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=request.user)
-    pending_requests = user_connections.pending_requests.all()
-    pending_requests_list = [{'id': user.id, 'username': user.username} for user in pending_requests]
-
-    return Response({'pending_requests': pending_requests_list}, status=status.HTTP_200_OK)
+    return connection_list_response(request, 'pending_requests')
 
 @api_view(['GET'])
+@conditional_on_version(CONNECTIONS)
 def check_sent_requests(request):
     """
     Retrieve sent friend requests for the authenticated user.
 
     This view returns a list of friend requests sent by the
-    authenticated user.
+    authenticated user. The response carries an ETag, and a request with a
+    matching If-None-Match header gets a 304 without the list being queried.
 
     Args:
-        request (HttpRequest): The request object containing the authenticated user token.
+        request (HttpRequest): The request object containing the authenticated user token,
+                               and the optional 'ordering' ('recent' or 'name') and 'q'
+                               (part of a username or name) in the query parameters.
 
     Returns:
         Response: A Response object containing a list of sent friend requests.
     """
-    user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=request.user)
-    sent_requests = user_connections.sent_requests.all()
-    sent_requests_list = [{'id': user.id, 'username': user.username} for user in sent_requests]
-
-    return Response({'sent_requests': sent_requests_list}, status=status.HTTP_200_OK)
+    return connection_list_response(request, 'sent_requests')
 
 @api_view(['GET'])
+@conditional_on_version(CONNECTIONS)
 def check_friends(request):
     """
     Retrieve friends for the authenticated user.
 
     This view returns a list of friends for the
-    authenticated user.
+    authenticated user. The response carries an ETag, and a request with a
+    matching If-None-Match header gets a 304 without the list being queried.
 
     Args:
-        request (HttpRequest): The request object containing the authenticated user token.
+        request (HttpRequest): The request object containing the authenticated user token,
+                               and the optional 'ordering' ('recent' or 'name') and 'q'
+                               (part of a username or name) in the query parameters.
 
     Returns:
         Response: A Response object containing a list of friends.
     """
-    user_connections, created = UserConnectionIntermediateTable.objects.get_or_create(user=request.user)
-    friends = user_connections.friends.all()
-    friends_list = [{'id': user.id, 'username': user.username} for user in friends]
+    return connection_list_response(request, 'friends')
+
+@api_view(['GET'])
+@conditional_on_version(CONNECTIONS)
+def connection_summary(request):
+    """
+    Retrieve the friends, pending requests and sent requests of the authenticated user.
+
+    This view combines check_friends, check_pending_requests and
+    check_sent_requests in one round trip, with list sizes, for clients
+    that load all three at once. It runs two queries, the token lookup and
+    one for all three lists. The response carries an ETag, and
+    a request with a matching If-None-Match header gets a 304 without the
+    lists being queried.
+
+    Args:
+        request (HttpRequest): The request object containing the authenticated user token.
+
+    Returns:
+        Response: A Response object containing the three lists and their sizes.
+    """
+    return Response(load_summary(request.user), status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+def block_user(request):
+    """
+    Block another user on behalf of the authenticated user.
+
+    A blocked user no longer appears in the authenticated user's search results
+    and friend lists (and vice versa), and neither of them can send the other
+    a friend request. Pending requests between them, in either direction, are
+    deleted.
+
+    Args:
+        request (HttpRequest): The request object containing the authenticated user token
+                               and 'user_id' in the POST data.
+
+    Returns:
+        Response: A Response object containing a success message if the user is
+                  blocked successfully, or an error message if the request fails.
+    """
+    user_id = request.data.get('user_id')
+    user = get_object_or_404(User, id=user_id)
+
+    if request.user == user:
+        return Response({'error': 'You cannot block yourself.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        block, created = Block.objects.get_or_create(blocker=request.user, blocked=user)
+
+        if not created:
+            return Response({'error': 'User already blocked.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        cancel_requests_between(request.user, user)
+
+    invalidate_block_cache(request.user.id, user.id)
+
+    return Response({'message': 'User blocked successfully.'}, status=status.HTTP_201_CREATED)
+
+@api_view(['POST'])
+def unblock_user(request):
+    """
+    Remove a block created by the authenticated user.
+
+    Args:
+        request (HttpRequest): The request object containing the authenticated user token
+                               and 'user_id' in the POST data.
+
+    Returns:
+        Response: A Response object containing a success message if the user is
+                  unblocked successfully, or an error message if the request fails.
+    """
+    user_id = request.data.get('user_id')
+    user = get_object_or_404(User, id=user_id)
+
+    deleted, _ = Block.objects.filter(blocker=request.user, blocked=user).delete()
+
+    if not deleted:
+        return Response({'error': 'User is not blocked.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    invalidate_block_cache(request.user.id, user.id)
+
+    return Response({'message': 'User unblocked successfully.'}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def connection_distance(request):
+    """
+    Retrieve the degree of connection between the authenticated user and another user.
+
+    This view returns the number of friendship hops on the shortest path between
+    the two users: 1 for friends, 2 for friends of friends, and so on. The search
+    is limited to CONNECTION_DISTANCE_MAX_DEPTH hops.
+
+    Args:
+        request (HttpRequest): The request object containing the authenticated user token
+                               and 'user_id' in the query parameters.
+
+    Returns:
+        Response: A Response object containing the distance, which is None if the
+                  users are not connected within the search limits.
+    """
+    # The graph and snapshot modules are only needed here, keep them off the startup path
+    from .graph import degrees_of_separation, friend_loader
+
+    user_id = request.query_params.get('user_id')
+    user = get_object_or_404(User, id=user_id)
 
-    return Response({'friends': friends_list}, status=status.HTTP_200_OK)
+    if is_blocked(request.user.id, user.id):
+        distance = None
+    else:
+        distance = degrees_of_separation(request.user.id, user.id,
+                                         max_depth=settings.CONNECTION_DISTANCE_MAX_DEPTH,
+                                         max_frontier=settings.CONNECTION_DISTANCE_MAX_FRONTIER,
+                                         load_neighbors=friend_loader())
 
+    return Response({'user_id': user.id, 'distance': distance}, status=status.HTTP_200_OK)
@@ -0,0 +1,51 @@
+"""
+Middleware that only runs for the browser facing part of the site.
+
+The REST endpoints under API_URL_PREFIXES authenticate with tokens, so they
+never use sessions, CSRF cookies, messages or the session based user. The
+classes below behave exactly like the Django middleware they extend, except
+that API requests pass straight through them. Since they are subclasses, the
+admin keeps working and its system checks still recognise them.
+"""
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+
+def is_api_request(request):
+    return request.path_info.startswith(settings.API_URL_PREFIXES)
+
+
+class BrowserOnlyMixin:
+    """
+    Skip the middleware for requests to the token authenticated API.
+    """
+
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class BrowserSessionMiddleware(BrowserOnlyMixin, SessionMiddleware):
+    pass
+
+
+class BrowserCsrfViewMiddleware(BrowserOnlyMixin, CsrfViewMiddleware):
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The handler calls process_view directly, bypassing __call__
+        if is_api_request(request):
+            return None
+        return super().process_view(request, view_func, view_args, view_kwargs)
+
+
+class BrowserAuthenticationMiddleware(BrowserOnlyMixin, AuthenticationMiddleware):
+    pass
+
+
+class BrowserMessageMiddleware(BrowserOnlyMixin, MessageMiddleware):
+    pass
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,16 +44,21 @@ INSTALLED_APPS = [
     'users',
 ]
 
+# Session, CSRF, auth and messages middleware are skipped for the token
+# authenticated API and the health checks under API_URL_PREFIXES (see
+# demo_social.middleware).
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'demo_social.middleware.BrowserSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'demo_social.middleware.BrowserCsrfViewMiddleware',
+    'demo_social.middleware.BrowserAuthenticationMiddleware',
+    'demo_social.middleware.BrowserMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+API_URL_PREFIXES = ('/users/', '/connections/', '/healthz/', '/readyz/')
+
 ROOT_URLCONF = 'demo_social.urls'
 
 TEMPLATES = [
@@ -84,6 +90,30 @@ DATABASES = {
     }
 }
 
+# Opt-in copies of the connection edges, partitioned by hashed user id across
+# these aliases (see connection/sharding.py). Degrees of separation read
+# friends from them; everything else still uses 'default'.
+# demo_social.settings_test enables two shards for the test suite.
+# Shards are only ever appended: after adding one, run the
+# rebalance_connection_shards command.
+CONNECTION_SHARD_COUNT = int(os.environ.get('CONNECTION_SHARD_COUNT', 0))
+CONNECTION_SHARDS = [f'connection_shard_{number}' for number in range(CONNECTION_SHARD_COUNT)]
+
+for alias in CONNECTION_SHARDS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+    }
+
+DATABASE_ROUTERS = ['connection.routers.ConnectionShardRouter']
+
+
+# API logins authenticate by email, the admin by username
+AUTHENTICATION_BACKENDS = [
+    'users.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -136,3 +166,33 @@ REST_FRAMEWORK = {
     ],
 
 }
+
+# Friend requests left unanswered for longer than this are expired and archived
+# by the expire_pending_requests management command.
+CONNECTION_PENDING_REQUEST_TTL_DAYS = 30
+
+# Limits of the breadth-first search behind the connection distance endpoint
+# and the distance annotation of search results.
+CONNECTION_DISTANCE_MAX_DEPTH = 3
+CONNECTION_DISTANCE_MAX_FRONTIER = 10000
+
+# Directory of the prefix index behind /users/autocomplete/, published by the
+# build_autocomplete_index command and memory-mapped by every process. When
+# unset, each process builds its own index instead, which a background thread
+# rebuilds from the database after REBUILD_SECONDS, or once MAX_DELTA users
+# registered since the last build. Registrations handled by other processes
+# then show up after at most REFRESH_SECONDS.
+USER_AUTOCOMPLETE_INDEX_DIR = None
+USER_AUTOCOMPLETE_REBUILD_SECONDS = 60 * 60
+USER_AUTOCOMPLETE_REFRESH_SECONDS = 1
+USER_AUTOCOMPLETE_MAX_DELTA = 10000
+
+# Directory of the memory-mapped friendship graph snapshot written by the
+# build_graph_snapshot command. When set and built, analytical features such as
+# connection distance read friends from the snapshot instead of the database.
+GRAPH_SNAPSHOT_DIR = None
+
+# Incremental refreshes re-read the connections accepted this long before the
+# previous refresh, as acceptances are timestamped before they commit and by
+# the clocks of several hosts.
+GRAPH_SNAPSHOT_REFRESH_OVERLAP_SECONDS = 10 * 60
@@ -0,0 +1,114 @@
+"""
+Production settings for demo_social project.
+
+Extends the development settings in demo_social.settings. Select it with
+DJANGO_SETTINGS_MODULE=demo_social.settings_production and serve the project
+with gunicorn (see gunicorn.conf.py) instead of runserver.
+
+Configuration comes from the environment:
+    DJANGO_SECRET_KEY     Required.
+    DJANGO_ALLOWED_HOSTS  Comma separated host names, 'localhost' by default.
+    DJANGO_REDIS_URL      Cache shared by all workers, 'redis://localhost:6379/0'
+                          by default.
+    DJANGO_API_ONLY       Set to 1 for workers that only serve the token
+                          authenticated API. They load a slim set of apps:
+                          admin, sessions, messages, staticfiles, templates
+                          and the browsable API are left out, together with
+                          their middleware.
+    DJANGO_AUTOCOMPLETE_INDEX_DIR
+                          Directory the build_autocomplete_index command
+                          publishes the autocomplete index to. Unset, every
+                          worker builds and refreshes its own copy.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK, TEMPLATES
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+# DEBUG keeps every executed SQL query in memory for the whole request
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+
+# Application definition
+
+API_ONLY = os.environ.get('DJANGO_API_ONLY') == '1'
+
+if API_ONLY:
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS
+        if app not in (
+            'django.contrib.admin',
+            'django.contrib.sessions',
+            'django.contrib.messages',
+            'django.contrib.staticfiles',
+            # Only provides the templates and static files of the browsable API
+            'rest_framework',
+        )
+    ]
+    # Token authentication needs neither sessions, messages nor CSRF cookies,
+    # and DRF authenticates the user itself
+    MIDDLEWARE = [
+        middleware for middleware in MIDDLEWARE
+        if middleware not in (
+            'demo_social.middleware.BrowserSessionMiddleware',
+            'demo_social.middleware.BrowserCsrfViewMiddleware',
+            'demo_social.middleware.BrowserAuthenticationMiddleware',
+            'demo_social.middleware.BrowserMessageMiddleware',
+        )
+    ]
+
+# API-only workers render JSON exclusively and never load a template engine
+TEMPLATES = [] if API_ONLY else [
+    {
+        **TEMPLATES[0],
+        'OPTIONS': {
+            'context_processors': [
+                processor for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+                if processor != 'django.template.context_processors.debug'
+            ],
+        },
+    },
+]
+
+
+# Database
+# Keep connections open between requests instead of reconnecting every time.
+
+DATABASES = {
+    alias: {**database, 'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True}
+    for alias, database in DATABASES.items()
+}
+
+
+# The browsable API renders HTML templates on every call, clients only need JSON
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+}
+
+
+# Cache
+# Block sets and ETag version stamps are invalidated through the cache, so
+# every worker process must share the same one.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('DJANGO_REDIS_URL', 'redis://localhost:6379/0'),
+    }
+}
+
+
+# Autocomplete
+# One index published per host and mapped by all workers, instead of a copy
+# and a refresher thread per worker.
+
+USER_AUTOCOMPLETE_INDEX_DIR = os.environ.get('DJANGO_AUTOCOMPLETE_INDEX_DIR')
@@ -0,0 +1,25 @@
+"""
+Test settings for demo_social project.
+
+Extends the development settings in demo_social.settings with two connection
+shards, so the shadow writes of connection/sharding.py are exercised too:
+
+    python manage.py test --settings=demo_social.settings_test
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+CONNECTION_SHARD_COUNT = 2
+CONNECTION_SHARDS = [f'connection_shard_{number}' for number in range(CONNECTION_SHARD_COUNT)]
+
+DATABASES = {
+    **DATABASES,
+    **{
+        alias: {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'{alias}.sqlite3',
+        }
+        for alias in CONNECTION_SHARDS
+    },
+}
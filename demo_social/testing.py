@@ -0,0 +1,42 @@
+"""
+Helpers shared by the test suites and benchmark commands of every app.
+"""
+
+from contextlib import contextmanager
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase
+
+
+class CacheIsolatedTestCase(TestCase):
+    """
+    A TestCase that runs every test against an empty cache.
+
+    Throttling history, version stamps and block sets are cached per user id,
+    and ids are reused between tests, so they must not outlive a test.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """
+    Run a block inside a transaction that is always rolled back.
+
+    Benchmarks create their synthetic data inside it, so nothing is left
+    behind, whether they finish or fail.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
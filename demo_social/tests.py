@@ -0,0 +1,71 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
+from django.urls import reverse
+
+
+class MiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='pass')
+        self.token = Token.objects.create(user=self.user)
+
+    def test_api_requests_skip_browser_middleware(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(reverse('check_friends'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+        self.assertFalse(hasattr(response.wsgi_request, '_messages'))
+        self.assertNotIn('csrftoken', response.cookies)
+
+    def test_admin_keeps_browser_middleware(self):
+        response = self.client.get(reverse('admin:login'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hasattr(response.wsgi_request, 'session'))
+        self.assertIn('csrftoken', response.cookies)
+
+
+class ApiDocTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.api_doc_url = reverse('api_doc')
+
+    def test_api_doc(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(self.api_doc_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('ETag', response)
+
+        endpoints = {doc['name']: doc['endpoint'] for doc in response.json()}
+        self.assertEqual(endpoints['Register'], 'http://testserver/users/register/')
+        self.assertEqual(endpoints['Check Friends'], 'http://testserver/connections/check_friends/')
+
+    def test_api_doc_not_modified(self):
+        etag = self.client.get(self.api_doc_url)['ETag']
+        response = self.client.get(self.api_doc_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'api.example.com'])
+    def test_api_doc_per_host(self):
+        etag = self.client.get(self.api_doc_url)['ETag']
+
+        response = self.client.get(self.api_doc_url, HTTP_HOST='api.example.com', secure=True,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        endpoints = {doc['name']: doc['endpoint'] for doc in response.json()}
+        self.assertEqual(endpoints['Register'], 'https://api.example.com/users/register/')
+
+    def test_health_checks(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('liveness'))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'ok')
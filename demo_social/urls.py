@@ -14,13 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import include,path
 from . import views
 
 urlpatterns = [
     path('', views.api_doc, name='api_doc'),
-    path('admin/', admin.site.urls),
+    path('healthz/', views.liveness, name='liveness'),
+    path('readyz/', views.readiness, name='readiness'),
     path('connections/', include('connection.urls')),
     path('users/', include('users.urls')),
 ]
+
+# API-only workers run without the admin (see settings_production)
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))
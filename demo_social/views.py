@@ -1,110 +1,278 @@
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.response import Response
-from rest_framework import status
-from django.urls import reverse
+from functools import lru_cache
+import hashlib
+import json
+from django.db import connection
+from django.http import HttpResponse
+from django.urls import get_resolver
+from django.views.decorators.http import condition, require_safe
 
 
-@api_view(['GET'])
-@permission_classes([AllowAny])
-def api_doc(request):
+# Endpoints documented on the index page, in display order. Their URLs are
+# resolved from the URL configuration when the index is built.
+API_DOCS = [
+    {
+        "name": "Register",
+        "url_name": "register",
+        "description": "Register a new user.",
+        "required_data": ["password", "email"],
+        "optional_data": ["first_name", "last_name"],
+        "returns": {
+            "success": "token (Authentication token for the registered user)",
+            "error": "error message for invalid or incomplete data"
+        }
+    },
+    {
+        "name": "Login",
+        "url_name": "login",
+        "description": "Log in an existing user.",
+        "required_data": ["email", "password"],
+        "returns": {
+            "success": "token (Authentication token for the logged-in user)",
+            "error": "error: 'Invalid credentials' for incorrect login credentials"
+        }
+    },
+    {
+        "name": "User Details",
+        "url_name": "user_details",
+        "description": "Retrieve details of the authenticated user.",
+        "required_data": None,
+        "returns": "Details of the authenticated user"
+    },
+    {
+        "name": "Search Users",
+        "url_name": "search_users",
+        "description": "Search for users by email or username.",
+        "required_data": ["keyword"],
+        "optional_data": ["page", "with_distance"],
+        "returns": "List of users matching the search criteria"
+    },
+    {
+        "name": "Autocomplete Users",
+        "url_name": "autocomplete_users",
+        "description": "Suggest users whose name or email starts with the text typed so far.",
+        "required_data": ["q"],
+        "optional_data": ["limit"],
+        "returns": "results: the suggested users"
+    },
+    {
+        "name": "Send Friend Request",
+        "url_name": "send_friend_request",
+        "description": "Send a friend request from the authenticated user to another user.",
+        "required_data": ["to_user_id"],
+        "returns": {
+            "success": "message: 'Friend request sent successfully.'",
+            "error": [
+                "error: 'You cannot send a friend request to yourself.'",
+                "error: 'Friend request already sent.'",
+                "other relevant error messages"
+            ]
+        }
+    },
+    {
+        "name": "Accept Friend Request",
+        "url_name": "accept_friend_request",
+        "description": "Accept a friend request sent to the authenticated user.",
+        "required_data": ["from_user_id"],
+        "returns": {
+            "success": "message: 'Friend request accepted successfully.'",
+            "error": [
+                "error: 'Friend request already accepted.'",
+                "error: 'You cannot accept a friend request from this user.'",
+                "other relevant error messages"
+            ]
+        }
+    },
+    {
+        "name": "Accept All Friend Requests",
+        "url_name": "accept_all_friend_requests",
+        "description": "Accept every pending friend request sent to the authenticated user.",
+        "required_data": None,
+        "optional_data": ["since"],
+        "returns": {
+            "success": "accepted: number of requests accepted",
+            "error": ["error: 'since must be an ISO 8601 timestamp.'"]
+        }
+    },
+    {
+        "name": "Reject Friend Request",
+        "url_name": "reject_friend_request",
+        "description": "Reject a friend request sent to the authenticated user.",
+        "required_data": ["from_user_id"],
+        "returns": {
+            "success": "message: 'Friend request rejected successfully.'",
+            "error": [
+                "error: 'Friend request already accepted.'",
+                "other relevant error messages"
+            ]
+        }
+    },
+    {
+        "name": "Check Pending Requests",
+        "url_name": "check_pending_requests",
+        "description": "Retrieve pending friend requests sent to the authenticated user.",
+        "required_data": None,
+        "optional_data": ["ordering", "q"],
+        "returns": "List of pending friend requests"
+    },
+    {
+        "name": "Check Sent Requests",
+        "url_name": "check_sent_requests",
+        "description": "Retrieve sent friend requests by the authenticated user.",
+        "required_data": None,
+        "optional_data": ["ordering", "q"],
+        "returns": "List of sent friend requests"
+    },
+    {
+        "name": "Check Friends",
+        "url_name": "check_friends",
+        "description": "Retrieve friends of the authenticated user.",
+        "required_data": None,
+        "optional_data": ["ordering", "q"],
+        "returns": "List of friends"
+    },
+    {
+        "name": "Block User",
+        "url_name": "block_user",
+        "description": "Block another user on behalf of the authenticated user.",
+        "required_data": ["user_id"],
+        "returns": {
+            "success": "message: 'User blocked successfully.'",
+            "error": [
+                "error: 'You cannot block yourself.'",
+                "error: 'User already blocked.'",
+                "other relevant error messages"
+            ]
+        }
+    },
+    {
+        "name": "Unblock User",
+        "url_name": "unblock_user",
+        "description": "Remove a block created by the authenticated user.",
+        "required_data": ["user_id"],
+        "returns": {
+            "success": "message: 'User unblocked successfully.'",
+            "error": [
+                "error: 'User is not blocked.'",
+                "other relevant error messages"
+            ]
+        }
+    },
+    {
+        "name": "Connection Distance",
+        "url_name": "connection_distance",
+        "description": "Retrieve the degree of connection between the authenticated user and another user.",
+        "required_data": ["user_id"],
+        "returns": "distance (number of friendship hops, null if not connected within the search limits)"
+    },
+    {
+        "name": "Connection Summary",
+        "url_name": "connection_summary",
+        "description": "Retrieve the friends, pending requests and sent requests of the authenticated user in one call.",
+        "required_data": None,
+        "returns": "friends, pending_requests, sent_requests and counts"
+    }
+]
+
+
+def api_doc_paths():
+    """
+    Map the URL names in API_DOCS to their paths, walking the URL resolver.
+
+    Returns:
+        dict: The path of every named URL pattern, keyed by URL name.
+    """
+    paths = {}
+
+    def walk(resolver, prefix):
+        for pattern in resolver.url_patterns:
+            route = prefix + str(pattern.pattern)
+            if hasattr(pattern, 'url_patterns'):
+                walk(pattern, route)
+            elif pattern.name:
+                paths.setdefault(pattern.name, '/' + route)
+
+    walk(get_resolver(), '')
+    return paths
+
+
+# Stands in for the scheme and host of the request in the pre-serialized index
+BASE_URL_PLACEHOLDER = '{base_url}'
+
+
+@lru_cache(maxsize=1)
+def api_doc_template():
+    """
+    Serialize the API index once, with a placeholder in front of every endpoint path.
+
+    The gunicorn master builds it before forking (see gunicorn.conf.py), so
+    workers serve it without walking the URL resolver or serializing anything.
+
+    Returns:
+        tuple: The JSON body split around the placeholders, as a list of bytes,
+               and the ETag of the body.
+    """
+    paths = api_doc_paths()
     api_docs = [
         {
-            "name": "Register",
-            "endpoint": request.build_absolute_uri('/users/register/'),
-            "description": "Register a new user.",
-            "required_data": ["password", "email"],
-            "optional_data": ["first_name", "last_name"],
-            "returns": {
-                "success": "token (Authentication token for the registered user)",
-                "error": "error message for invalid or incomplete data"
-            }
-        },
-        {
-            "name": "Login",
-            "endpoint": request.build_absolute_uri('/users/login/'),
-            "description": "Log in an existing user.",
-            "required_data": ["email", "password"],
-            "returns": {
-                "success": "token (Authentication token for the logged-in user)",
-                "error": "error: 'Invalid credentials' for incorrect login credentials"
-            }
-        },
-        {
-            "name": "User Details",
-            "endpoint": request.build_absolute_uri('/users/user/'),
-            "description": "Retrieve details of the authenticated user.",
-            "required_data": None,
-            "returns": "Details of the authenticated user"
-        },
-        {
-            "name": "Search Users",
-            "endpoint": request.build_absolute_uri('/users/search/'),
-            "description": "Search for users by email or username.",
-            "required_data": ["keyword"],
-            "returns": "List of users matching the search criteria"
-        },
-        {
-            "name": "Send Friend Request",
-            "endpoint": request.build_absolute_uri('/connections/send_friend_request/'),
-            "description": "Send a friend request from the authenticated user to another user.",
-            "required_data": ["to_user_id"],
-            "returns": {
-                "success": "message: 'Friend request sent successfully.'",
-                "error": [
-                    "error: 'You cannot send a friend request to yourself.'",
-                    "error: 'Friend request already sent.'",
-                    "other relevant error messages"
-                ]
-            }
-        },
-        {
-            "name": "Accept Friend Request",
-            "endpoint": request.build_absolute_uri('/connections/accept_friend_request/'),
-            "description": "Accept a friend request sent to the authenticated user.",
-            "required_data": ["from_user_id"],
-            "returns": {
-                "success": "message: 'Friend request accepted successfully.'",
-                "error": [
-                    "error: 'Friend request already accepted.'",
-                    "other relevant error messages"
-                ]
-            }
-        },
-        {
-            "name": "Reject Friend Request",
-            "endpoint": request.build_absolute_uri('/connections/reject_friend_request/'),
-            "description": "Reject a friend request sent to the authenticated user.",
-            "required_data": ["from_user_id"],
-            "returns": {
-                "success": "message: 'Friend request rejected successfully.'",
-                "error": [
-                    "error: 'Friend request already accepted.'",
-                    "other relevant error messages"
-                ]
-            }
-        },
-        {
-            "name": "Check Pending Requests",
-            "endpoint": request.build_absolute_uri('/connections/pending_requests/'),
-            "description": "Retrieve pending friend requests sent to the authenticated user.",
-            "required_data": None,
-            "returns": "List of pending friend requests"
-        },
-        {
-            "name": "Check Sent Requests",
-            "endpoint": request.build_absolute_uri('/connections/sent_requests/'),
-            "description": "Retrieve sent friend requests by the authenticated user.",
-            "required_data": None,
-            "returns": "List of sent friend requests"
-        },
-        {
-            "name": "Check Friends",
-            "endpoint": request.build_absolute_uri('/connections/check_friends/'),
-            "description": "Retrieve friends of the authenticated user.",
-            "required_data": None,
-            "returns": "List of friends"
+            'name': doc['name'],
+            'endpoint': BASE_URL_PLACEHOLDER + paths[doc['url_name']],
+            **{key: value for key, value in doc.items() if key not in ('name', 'url_name')},
         }
+        for doc in API_DOCS
     ]
-    
-    return Response(api_docs, status=status.HTTP_200_OK)
+    body = json.dumps(api_docs, separators=(',', ':')).encode()
+    return body.split(BASE_URL_PLACEHOLDER.encode()), hashlib.md5(body).hexdigest()
+
+
+def base_url(request):
+    # Escaped as the inside of a JSON string
+    return json.dumps(f'{request.scheme}://{request.get_host()}')[1:-1].encode()
+
+
+def api_doc_etag(request):
+    """
+    Return the ETag of the API index served to a request.
+
+    Endpoints are absolute URLs, so the ETag covers the scheme and host.
+    """
+    _, etag = api_doc_template()
+    return f'{etag}-{hashlib.md5(base_url(request)).hexdigest()[:8]}'
+
+
+@require_safe
+@condition(etag_func=api_doc_etag)
+def api_doc(request):
+    """
+    Describe the endpoints of the API.
+
+    The index is serialized once, and every response only joins the
+    pre-serialized chunks with the request's scheme and host. Clients sending
+    a matching If-None-Match header get an empty 304 response.
+
+    Args:
+        request (HttpRequest): The request object.
+
+    Returns:
+        HttpResponse: The JSON list of endpoints.
+    """
+    chunks, _ = api_doc_template()
+    return HttpResponse(base_url(request).join(chunks), content_type='application/json')
+
+
+def liveness(request):
+    """
+    Report that the process is up, without touching the database.
+    """
+    return HttpResponse(b'ok', content_type='text/plain')
+
+
+def readiness(request):
+    """
+    Report whether the process can serve requests, checking the database connection.
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Exception:
+        return HttpResponse(b'database unavailable', content_type='text/plain', status=503)
+    return HttpResponse(b'ok', content_type='text/plain')
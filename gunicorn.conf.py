@@ -0,0 +1,72 @@
+"""
+Gunicorn configuration for serving demo_social in production.
+
+    DJANGO_SETTINGS_MODULE=demo_social.settings_production gunicorn -c gunicorn.conf.py
+
+Every value can be overridden from the environment. Set
+GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker and
+GUNICORN_APP=demo_social.asgi:application to serve the ASGI application instead.
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = os.environ.get('GUNICORN_APP', 'demo_social.wsgi:application')
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Preforked workers scaled to the available cores. Each serves several
+# requests at once on threads, so identical concurrent reads of one user can
+# share a single query (see connection/singleflight.py).
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import Django once in the master so workers fork with the code already loaded
+preload_app = True
+
+# Recycle workers after a jittered number of requests so memory growth is
+# bounded and workers do not all restart at the same time
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 500))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG')
+errorlog = '-'
+
+
+def when_ready(server):
+    """
+    Load the URLconf, and with it every view module, serialize the API
+    index and build the autocomplete index in the master, unless it is
+    published to USER_AUTOCOMPLETE_INDEX_DIR.
+
+    Django only imports the URLconf on the first request, which would
+    otherwise cost each new or recycled worker around 100 ms. Forked workers
+    share the already imported modules instead.
+    """
+    from django.conf import settings
+    from django.db import connections
+    from django.urls import get_resolver
+    from demo_social.views import api_doc_template
+    from users.autocomplete import build_index
+
+    get_resolver().url_patterns
+    api_doc_template()
+    # Workers share the autocomplete index built here until they swap in their own
+    if not settings.USER_AUTOCOMPLETE_INDEX_DIR:
+        build_index()
+    # Workers must not inherit a database connection opened in the master
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    """
+    Start the worker's autocomplete refresher thread, which catches up with
+    new users and swaps in rebuilt indexes off the request path. Workers
+    mapping a published index start none.
+    """
+    from users.autocomplete import start_refresher
+
+    start_refresher()
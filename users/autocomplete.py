@@ -0,0 +1,441 @@
+from array import array
+from bisect import bisect_left
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+from django.utils import timezone
+from heapq import merge
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+from .emails import normalize_email
+
+logger = logging.getLogger(__name__)
+
+# Separates a term from the id of its user inside the build buffer
+SEPARATOR = b'\x00'
+
+MANIFEST = 'manifest.json'
+INDEX_FILE = re.compile(r'^(terms|offsets|user_ids)-(\d+)\.bin$')
+
+
+def normalize_text(text):
+    return ' '.join((text or '').casefold().split())
+
+
+def index_terms(first_name, last_name, email):
+    """
+    Return the terms a user can be found by while typing.
+
+    Every word of the full name starts a term, so 'jane s' finds 'Mary Jane
+    Smith'. The normalized email is a term of its own.
+
+    Returns:
+        set: The terms, as UTF-8 bytes.
+    """
+    words = normalize_text(f'{first_name} {last_name}').split(' ')
+    terms = {' '.join(words[start:]) for start in range(len(words))}
+    terms.add(normalize_email(email))
+    terms.discard('')
+    return {term.encode() for term in terms}
+
+
+class _Terms:
+    """
+    The sorted terms of a PrefixIndex, as a sequence bisect can search.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.blob[self.offsets[position]:self.offsets[position + 1]]
+
+
+class PrefixIndex:
+    """
+    Find users by a prefix of their name or email.
+
+    Terms are sorted and stored back to back in one byte array, with two
+    flat arrays holding where each term starts and which user it belongs to.
+    A lookup bisects to the first term at or after the prefix and reads
+    forward, so it costs O(log n + k) and allocates almost nothing. Users
+    registered after the build go to a small sorted delta buffer, merged in
+    at query time, until the next rebuild.
+
+    The three buffers are either built in memory or memory-mapped from an
+    index published to a directory (see publish_index()), in which case
+    every worker process on the host shares the same physical pages.
+
+    Attributes:
+        high_water (int): The highest user id the index has seen.
+        built_at (float): The time.monotonic() of the build or load.
+    """
+
+    def __init__(self, blob, offsets, user_ids, high_water):
+        """
+        Args:
+            blob (bytes-like): The sorted terms, back to back.
+            offsets (sequence): Where each term starts in blob, then the end of the last one.
+            user_ids (sequence): The user of each term.
+            high_water (int): The highest user id included.
+        """
+        self.terms = _Terms(blob, offsets)
+        self.user_ids = user_ids
+        self.delta = []
+        self.delta_ids = set()
+        self.high_water = high_water
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls, rows):
+        """
+        Build an index from a stream of users.
+
+        Args:
+            rows (iterable): (id, first_name, last_name, email) tuples.
+
+        Returns:
+            PrefixIndex: The index.
+        """
+        entries = []
+        high_water = 0
+        for user_id, first_name, last_name, email in rows:
+            suffix = SEPARATOR + user_id.to_bytes(8, 'big')
+            entries.extend(term + suffix for term in index_terms(first_name, last_name, email))
+            high_water = max(high_water, user_id)
+        entries.sort()
+
+        # Each entry is a term, SEPARATOR and the user id as 8 big-endian bytes
+        blob = bytearray()
+        offsets = array('L', [0])
+        user_ids = array('q')
+        for entry in entries:
+            blob += entry[:-9]
+            offsets.append(len(blob))
+            user_ids.append(int.from_bytes(entry[-8:], 'big'))
+        return cls(blob, offsets, user_ids, high_water)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory-map the index published to a directory.
+
+        Args:
+            directory (str): The directory publish_index() wrote to.
+
+        Returns:
+            PrefixIndex: The index, read-only apart from its delta buffer.
+        """
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            manifest = json.load(manifest)
+        files = manifest['files']
+        return cls(
+            _map(directory, files['terms']),
+            _map(directory, files['offsets'], 'L'),
+            _map(directory, files['user_ids'], 'q'),
+            manifest['high_water'],
+        )
+
+    def add(self, user_id, first_name, last_name, email):
+        """
+        Make a user registered after the build searchable.
+        """
+        self.add_many([(user_id, first_name, last_name, email)])
+
+    def add_many(self, rows):
+        """
+        Make users registered after the build searchable.
+
+        The delta buffer is replaced by a new sorted list rather than changed
+        in place, so searches running on other threads keep reading the list
+        they started with. Callers serialize adds with the module's _lock.
+
+        Args:
+            rows (iterable): (id, first_name, last_name, email) tuples.
+        """
+        delta = list(self.delta)
+        for user_id, first_name, last_name, email in rows:
+            if user_id in self.delta_ids:
+                continue
+            self.delta_ids.add(user_id)
+            delta.extend((term, user_id) for term in index_terms(first_name, last_name, email))
+        delta.sort()
+        self.delta = delta
+
+    def search(self, prefix, limit, exclude=frozenset()):
+        """
+        Return the users with a term starting with a prefix.
+
+        Args:
+            prefix (str): The text typed so far.
+            limit (int): The largest number of users returned.
+            exclude (set): The ids of users to leave out.
+
+        Returns:
+            list: The ids of at most limit users, in the order of their first
+                  matching term.
+        """
+        prefix = normalize_text(prefix).encode()
+        if not prefix:
+            return []
+        found = []
+        seen = set(exclude)
+        for _, user_id in merge(self._matches(prefix), self._delta_matches(self.delta, prefix)):
+            if user_id not in seen:
+                seen.add(user_id)
+                found.append(user_id)
+                if len(found) == limit:
+                    break
+        return found
+
+    def _matches(self, prefix):
+        position = bisect_left(self.terms, prefix)
+        while position < len(self.terms):
+            term = self.terms[position]
+            if not term.startswith(prefix):
+                return
+            yield term, self.user_ids[position]
+            position += 1
+
+    @staticmethod
+    def _delta_matches(delta, prefix):
+        position = bisect_left(delta, (prefix,))
+        while position < len(delta) and delta[position][0].startswith(prefix):
+            yield delta[position]
+            position += 1
+
+    @property
+    def term_count(self):
+        return len(self.terms) + len(self.delta)
+
+    @property
+    def nbytes(self):
+        """
+        The size of the term bytes and arrays, without the delta buffer.
+        """
+        offsets = self.terms.offsets
+        return len(self.terms.blob) + len(offsets) * offsets.itemsize + len(self.user_ids) * self.user_ids.itemsize
+
+
+def _map(directory, name, format=None):
+    with open(os.path.join(directory, name), 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return array(format) if format else b''
+        # The mapping stays valid after the file is closed
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(data).cast(format) if format else data
+
+
+_index = None
+_index_mtime = None
+_caught_up_at = 0
+# Guards changes to the current index; builds run outside it and are swapped in
+_lock = threading.Lock()
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def _active_users(queryset):
+    return queryset.filter(is_active=True).values_list('id', 'first_name', 'last_name', 'email')
+
+
+def get_index():
+    """
+    Return this process's autocomplete index.
+
+    Never builds or refreshes the index itself, so requests only ever pay for
+    a lookup. With USER_AUTOCOMPLETE_INDEX_DIR set, the index published
+    there is mapped, and reopened once a newer one is published. Otherwise
+    the index is built by the gunicorn master before forking and kept fresh
+    by each worker's refresher thread (see gunicorn.conf.py). A process that
+    was not warmed that way, such as runserver, starts its refresher on first
+    use and searches an empty index until the build is swapped in.
+
+    Returns:
+        PrefixIndex: The index.
+    """
+    directory = settings.USER_AUTOCOMPLETE_INDEX_DIR
+    if directory:
+        return _published_index(directory)
+    index = _index
+    if index is None:
+        start_refresher()
+        return PrefixIndex.build([])
+    return index
+
+
+def _published_index(directory):
+    global _index, _index_mtime
+    try:
+        mtime = os.stat(os.path.join(directory, MANIFEST)).st_mtime_ns
+    except FileNotFoundError:
+        # Nothing published yet
+        return PrefixIndex.build([])
+    if _index is not None and _index_mtime == mtime:
+        return _index
+    with _lock:
+        if _index is None or _index_mtime != mtime:
+            index = PrefixIndex.load(directory)
+            if _index is not None:
+                # Keep the registrations this process saw that the new index missed
+                index.delta = [item for item in _index.delta if item[1] > index.high_water]
+                index.delta_ids = {user_id for _, user_id in index.delta}
+            _index = index
+            _index_mtime = mtime
+        return _index
+
+
+def build_index():
+    """
+    Build a new index from a streaming scan of the active users and swap it in.
+
+    Users registered while the scan ran are picked up by the catch-up that
+    follows.
+
+    Returns:
+        PrefixIndex: The new index.
+    """
+    global _index, _caught_up_at
+    index = PrefixIndex.build(_active_users(User.objects.all()).iterator(chunk_size=5000))
+    with _lock:
+        _index = index
+        _caught_up_at = 0
+    catch_up()
+    return index
+
+
+def publish_index(directory):
+    """
+    Build an index from a streaming scan of the active users and publish it to a directory.
+
+    Run on a schedule by one process per host (see build_autocomplete_index),
+    so the workers map one shared index instead of each building and
+    refreshing its own.
+
+    Args:
+        directory (str): The directory the index is written to.
+
+    Returns:
+        dict: The manifest of the new index.
+    """
+    index = PrefixIndex.build(_active_users(User.objects.all()).iterator(chunk_size=5000))
+    os.makedirs(directory, exist_ok=True)
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            version = json.load(manifest)['version'] + 1
+    except FileNotFoundError:
+        version = 1
+
+    files = {part: f'{part}-{version}.bin' for part in ('terms', 'offsets', 'user_ids')}
+    with open(os.path.join(directory, files['terms']), 'wb') as f:
+        f.write(index.terms.blob)
+    with open(os.path.join(directory, files['offsets']), 'wb') as f:
+        index.terms.offsets.tofile(f)
+    with open(os.path.join(directory, files['user_ids']), 'wb') as f:
+        index.user_ids.tofile(f)
+    manifest = {
+        'version': version,
+        'files': files,
+        'terms': len(index.terms),
+        'high_water': index.high_water,
+        'built_at': timezone.now().isoformat(),
+    }
+    # Swapping the manifest publishes the index atomically. Workers keep
+    # reading the previous files until they reopen, so the previous
+    # generation is kept and only older ones are deleted.
+    path = os.path.join(directory, MANIFEST)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(f'{path}.tmp', path)
+    for name in os.listdir(directory):
+        match = INDEX_FILE.match(name)
+        if match and int(match.group(2)) < version - 1:
+            os.remove(os.path.join(directory, name))
+    return manifest
+
+
+def catch_up():
+    """
+    Add users registered through other processes to the index, with a range
+    query above the highest id already indexed.
+    """
+    global _caught_up_at
+    index = _index
+    if index is None:
+        return
+    rows = list(_active_users(User.objects.filter(id__gt=index.high_water)).order_by('id'))
+    with _lock:
+        index.add_many(rows)
+        index.high_water = max([index.high_water] + [row[0] for row in rows])
+        _caught_up_at = time.monotonic()
+
+
+def refresh_index():
+    """
+    Rebuild the index once it is older than USER_AUTOCOMPLETE_REBUILD_SECONDS,
+    or its delta buffer outgrew USER_AUTOCOMPLETE_MAX_DELTA, and catch up with
+    new registrations at most every USER_AUTOCOMPLETE_REFRESH_SECONDS otherwise.
+    """
+    index = _index
+    now = time.monotonic()
+    if (index is None or now - index.built_at > settings.USER_AUTOCOMPLETE_REBUILD_SECONDS
+            or len(index.delta_ids) > settings.USER_AUTOCOMPLETE_MAX_DELTA):
+        build_index()
+    elif now - _caught_up_at > settings.USER_AUTOCOMPLETE_REFRESH_SECONDS:
+        catch_up()
+
+
+def _refresh_forever():
+    while True:
+        try:
+            refresh_index()
+        except Exception:
+            # Keep serving the current index, the next pass retries
+            logger.exception('Autocomplete index refresh failed')
+        finally:
+            close_old_connections()
+        time.sleep(settings.USER_AUTOCOMPLETE_REFRESH_SECONDS)
+
+
+def start_refresher():
+    """
+    Start this process's refresher thread, unless it is already running or
+    the index is published by another process.
+
+    Threads do not survive a fork, so every gunicorn worker starts its own.
+    """
+    global _refresher
+    if settings.USER_AUTOCOMPLETE_INDEX_DIR:
+        return
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresh_forever, name='autocomplete-refresher', daemon=True)
+            _refresher.start()
+
+
+def user_registered(user):
+    """
+    Add a new user to this process's index, if it has been built.
+    """
+    if _index is not None and user.is_active:
+        with _lock:
+            _index.add(user.id, user.first_name, user.last_name, user.email)
+
+
+def reset_index():
+    """
+    Drop this process's index.
+    """
+    global _index, _index_mtime
+    with _lock:
+        _index = None
+        _index_mtime = None
@@ -0,0 +1,24 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from .emails import get_user_by_email
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authenticate with an email address, matched in any case or spacing.
+
+    The user is found with a single lookup on the normalized email index.
+    Permissions are handled by ModelBackend.
+    """
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+        user = get_user_by_email(email)
+        if user is None:
+            # Hash anyway, so response times do not reveal which emails are registered
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.db.models.functions import Lower, Trim
+
+# Name of the unique expression index on the normalized email, created by
+# migration 0001_normalized_email_key. Lookups must filter on email_key()
+# for the database to match them against the index.
+EMAIL_KEY_INDEX = 'auth_user_email_key_uniq'
+
+
+def email_key():
+    return Lower(Trim('email'))
+
+
+def normalize_email(email):
+    """
+    Return the key two spellings of the same email address share.
+
+    Args:
+        email (str): An email address as typed by a user.
+
+    Returns:
+        str: The address without surrounding whitespace, in lowercase.
+    """
+    return (email or '').strip().lower()
+
+
+def users_with_email(email):
+    """
+    Return the users whose email normalizes to the same key as the given one.
+
+    The query is a single lookup on the unique email key index, so it returns
+    at most one user.
+
+    Args:
+        email (str): An email address as typed by a user.
+
+    Returns:
+        QuerySet: The matching users, empty for a blank address.
+    """
+    key = normalize_email(email)
+    if not key:
+        return User.objects.none()
+    # The exclude repeats the condition of the partial index, so it applies
+    return User.objects.alias(email_key=email_key()).filter(email_key=key).exclude(email='')
+
+
+def get_user_by_email(email):
+    """
+    Return the user registered with an email address, in any case or spacing.
+
+    Args:
+        email (str): An email address as typed by a user.
+
+    Returns:
+        User or None: The user, or None if the address is not registered.
+    """
+    return users_with_email(email).first()
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from users.autocomplete import PrefixIndex
+import random
+import statistics
+import time
+import tracemalloc
+
+FIRST_NAMES = ['james', 'mary', 'robert', 'patricia', 'john', 'jennifer', 'michael', 'linda', 'david', 'elizabeth',
+               'william', 'barbara', 'richard', 'susan', 'joseph', 'jessica', 'thomas', 'sarah', 'charles', 'karen']
+LAST_NAMES = ['smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'rodriguez', 'martinez',
+              'hernandez', 'lopez', 'gonzalez', 'wilson', 'anderson', 'thomas', 'taylor', 'moore', 'jackson', 'martin']
+
+
+class Command(BaseCommand):
+    help = 'Measure the memory and lookup latency of the autocomplete prefix index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000, help='Number of synthetic users indexed')
+        parser.add_argument('--queries', type=int, default=10000, help='Number of timed lookups')
+        parser.add_argument('--limit', type=int, default=10, help='Number of users returned per lookup')
+
+    def handle(self, *args, **kwargs):
+        total = kwargs['users']
+        random.seed(0)
+        rows = (
+            (user_id, random.choice(FIRST_NAMES).title(), f'{random.choice(LAST_NAMES).title()}{user_id % 997}',
+             f'user{user_id}@example.com')
+            for user_id in range(1, total + 1)
+        )
+
+        rows = list(rows)
+        started = time.perf_counter()
+        index = PrefixIndex.build(rows)
+        elapsed = time.perf_counter() - started
+
+        # Traced separately, tracing slows the build down several times
+        del index
+        tracemalloc.start()
+        index = PrefixIndex.build(rows)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del rows
+
+        per_million = 1000000 / total
+        self.stdout.write(f'Built {index.term_count} terms for {total} users in {elapsed:.2f}s.')
+        self.stdout.write(
+            f'Index size {index.nbytes / 2 ** 20:.1f} MB ({index.nbytes / total:.0f} bytes per user, '
+            f'{index.nbytes * per_million / 2 ** 20:.0f} MB per million users); '
+            f'{retained * per_million / 2 ** 20:.0f} MB retained and {peak * per_million / 2 ** 20:.0f} MB peak '
+            f'during the build, per million users.'
+        )
+
+        prefixes = [random.choice(FIRST_NAMES + LAST_NAMES)[:random.randint(1, 5)] for _ in range(kwargs['queries'])]
+        prefixes += [f'user{random.randint(1, total)}'[:random.randint(5, 9)] for _ in range(kwargs['queries'])]
+        timings = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.search(prefix, kwargs['limit'])
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.stdout.write(
+            f'Lookup of the top {kwargs["limit"]}: p50 {statistics.median(timings) * 1e6:.1f} us, '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1e6:.1f} us over {len(timings)} prefixes.'
+        )
+        self.stdout.write(self.style.SUCCESS(f'Benchmark finished with {total} users.'))
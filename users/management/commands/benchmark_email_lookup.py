@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from users.emails import users_with_email
+from demo_social.testing import rolled_back
+import timeit
+
+
+class Command(BaseCommand):
+    help = 'Compare email lookups on auth_user with and without the normalized email index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000000, help='Number of synthetic users to create')
+        parser.add_argument('--batch-size', type=int, default=20000, help='Number of users inserted per query')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs per lookup')
+
+    def handle(self, *args, **kwargs):
+        with rolled_back():
+            self.run(kwargs)
+
+    def run(self, options):
+        total = options['users']
+        batch_size = options['batch_size']
+        for start in range(0, total, batch_size):
+            User.objects.bulk_create(
+                User(username=f'bench_email_{i}', email=f'Bench.Email.{i}@Example.com')
+                for i in range(start, min(start + batch_size, total))
+            )
+        self.stdout.write(f'Inserted {total} users.')
+
+        # A user in the middle of the table, typed as in the registration form
+        typed = f'  bench.email.{total // 2}@example.COM '
+        stored = f'Bench.Email.{total // 2}@Example.com'
+        lookups = [
+            ('exact email (previous search)', lambda: User.objects.filter(email=stored).first()),
+            ('case-insensitive email, no index', lambda: User.objects.filter(email__iexact=typed.strip()).first()),
+            ('normalized email index', lambda: users_with_email(typed).first()),
+        ]
+
+        repeat = options['repeat']
+        for name, lookup in lookups:
+            assert lookup() is not None
+            elapsed = min(timeit.repeat(lookup, number=1, repeat=repeat))
+            self.stdout.write(f'{name}: {elapsed * 1000:.3f} ms')
+        self.stdout.write(self.style.SUCCESS(f'Benchmark finished with {total} users.'))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from users.autocomplete import publish_index
+import time
+
+
+class Command(BaseCommand):
+    help = 'Publish the autocomplete prefix index for every worker process to memory-map'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default=settings.USER_AUTOCOMPLETE_INDEX_DIR,
+                            help='Index directory, USER_AUTOCOMPLETE_INDEX_DIR by default')
+
+    def handle(self, *args, **kwargs):
+        directory = kwargs['directory']
+        if not directory:
+            raise CommandError('Set USER_AUTOCOMPLETE_INDEX_DIR or pass --directory.')
+
+        started = time.monotonic()
+        manifest = publish_index(directory)
+        self.stdout.write(self.style.SUCCESS(
+            f'Index version {manifest["version"]} written to {directory}: {manifest["terms"]} terms of users '
+            f'up to id {manifest["high_water"]} in {time.monotonic() - started:.2f}s.'
+        ))
@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from http.client import HTTPException
+from urllib.request import Request, urlopen
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = 'Measure requests per second and latency of a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='URL to request, e.g. http://localhost:8000/connections/check_friends/')
+        parser.add_argument('--token', help='Authentication token sent with every request')
+        parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent clients')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run the test for')
+
+    def handle(self, *args, **kwargs):
+        headers = {'Authorization': f'Token {kwargs["token"]}'} if kwargs['token'] else {}
+        deadline = time.monotonic() + kwargs['duration']
+
+        def client():
+            latencies = []
+            errors = 0
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    with urlopen(Request(kwargs['url'], headers=headers)) as response:
+                        response.read()
+                # Error statuses, refused or reset connections and timeouts all
+                # count as errors instead of stopping the client
+                except (OSError, HTTPException):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+            return latencies, errors
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(kwargs['concurrency']) as executor:
+            results = list(executor.map(lambda _: client(), range(kwargs['concurrency'])))
+        elapsed = time.monotonic() - started
+
+        latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+        errors = sum(client_errors for _, client_errors in results)
+        if not latencies:
+            self.stdout.write(self.style.ERROR('No request completed.'))
+            return
+        self.stdout.write(
+            f'{len(latencies)} requests in {elapsed:.1f}s with {kwargs["concurrency"]} clients, {errors} errors\n'
+            f'{len(latencies) / elapsed:.1f} requests/sec, latency median {statistics.median(latencies) * 1000:.1f} ms, '
+            f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms'
+        )
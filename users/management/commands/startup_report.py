@@ -0,0 +1,142 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import subprocess
+import sys
+
+# Runs in a fresh interpreter, so nothing imported by manage.py skews the numbers
+STARTUP_SCRIPT = r'''
+import json
+import resource
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+started = time.perf_counter()
+from django.apps import AppConfig
+
+ready_times = {}
+create = AppConfig.create.__func__
+
+
+def timed_create(cls, entry):
+    app_config = create(cls, entry)
+    ready = app_config.ready
+
+    def timed_ready():
+        ready_started = time.perf_counter()
+        ready()
+        ready_times[app_config.label] = time.perf_counter() - ready_started
+
+    app_config.ready = timed_ready
+    return app_config
+
+
+AppConfig.create = classmethod(timed_create)
+
+from django.core.wsgi import get_wsgi_application
+
+application = get_wsgi_application()
+if sys.argv[2] == 'warm':
+    # What the gunicorn master does in when_ready before forking workers
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+setup_done = time.perf_counter()
+
+environ = {'PATH_INFO': sys.argv[1]}
+setup_testing_defaults(environ)
+status = []
+b''.join(application(environ, lambda response_status, headers: status.append(response_status)))
+first_request_done = time.perf_counter()
+
+json.dump({
+    'setup': setup_done - started,
+    'first_request': first_request_done - setup_done,
+    'total': first_request_done - started,
+    'status': status[0],
+    'ready': ready_times,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+}, sys.stdout)
+'''
+
+
+class Command(BaseCommand):
+    help = 'Report the cold-start time, import time and memory of a fresh worker process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/healthz/', help='Path of the first request served')
+        parser.add_argument('--warm-urls', action='store_true',
+                            help='Load the URLconf before the first request, as the gunicorn master does')
+        parser.add_argument('--runs', type=int, default=5, help='Number of cold starts measured, the fastest is kept')
+        parser.add_argument('--top', type=int, default=15, help='Number of packages listed by import time')
+        parser.add_argument('--save', help='Write the results to this JSON file, to serve as a baseline')
+        parser.add_argument('--baseline', help='Compare against a JSON file written by --save')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Fail when start time or memory grow by more than this fraction of the baseline')
+
+    def handle(self, *args, **kwargs):
+        runs = [self.cold_start(kwargs['path'], kwargs['warm_urls']) for _ in range(kwargs['runs'])]
+        result, imports = min(runs, key=lambda run: run[0]['total'])
+        result['max_rss_kb'] = min(run[0]['max_rss_kb'] for run in runs)
+
+        self.stdout.write(f'Settings: {os.environ.get("DJANGO_SETTINGS_MODULE")}')
+        self.stdout.write(
+            f'Cold start {result["total"] * 1000:.1f} ms: django.setup() and WSGI handler '
+            f'{result["setup"] * 1000:.1f} ms, first request to {kwargs["path"]} ({result["status"]}) '
+            f'{result["first_request"] * 1000:.1f} ms'
+        )
+        self.stdout.write(f'Peak resident memory {result["max_rss_kb"] / 1024:.1f} MB, {result["modules"]} modules loaded')
+
+        self.stdout.write('AppConfig.ready():')
+        for label, elapsed in sorted(result['ready'].items(), key=lambda item: -item[1]):
+            self.stdout.write(f'  {label:<20} {elapsed * 1000:8.2f} ms')
+
+        self.stdout.write('Import time by package (self time, -X importtime):')
+        for package, elapsed in sorted(imports.items(), key=lambda item: -item[1])[:kwargs['top']]:
+            self.stdout.write(f'  {package:<20} {elapsed / 1000:8.2f} ms')
+
+        if kwargs['save']:
+            with open(kwargs['save'], 'w') as f:
+                json.dump(result, f, indent=2)
+
+        if kwargs['baseline']:
+            self.compare(result, kwargs['baseline'], kwargs['max_regression'])
+
+    def cold_start(self, path, warm_urls):
+        """
+        Start a fresh interpreter and serve one request.
+
+        Returns:
+            tuple: The measurements and the import time, in microseconds, per top-level package.
+        """
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, path, 'warm' if warm_urls else 'cold'],
+            capture_output=True, text=True, env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'},
+        )
+        if process.returncode:
+            raise CommandError(f'Startup failed:\n{process.stderr[-2000:]}')
+
+        imports = {}
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_time, _, module = line[len('import time:'):].split('|')
+            package = module.strip().split('.')[0]
+            imports[package] = imports.get(package, 0) + int(self_time)
+        return json.loads(process.stdout), imports
+
+    def compare(self, result, path, max_regression):
+        with open(path) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for key, label in (('total', 'cold start time'), ('max_rss_kb', 'resident memory')):
+            change = result[key] / baseline[key] - 1
+            self.stdout.write(f'{label}: {change:+.1%} against {path}')
+            if change > max_regression:
+                regressions.append(label)
+
+        if regressions:
+            raise CommandError(f'{" and ".join(regressions)} regressed by more than {max_regression:.0%}.')
+        self.stdout.write(self.style.SUCCESS('No startup regression.'))
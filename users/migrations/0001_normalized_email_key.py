@@ -0,0 +1,46 @@
+from django.db import migrations
+from django.db.models import Count, F, Q, UniqueConstraint
+from django.db.models.functions import Lower, Trim
+
+# auth.User belongs to Django, so the index is created from here rather than
+# declared in a model's Meta. Blank emails are left out of it.
+EMAIL_KEY_CONSTRAINT = UniqueConstraint(Lower(Trim('email')), condition=~Q(email=''), name='auth_user_email_key_uniq')
+
+
+def dedupe_emails(apps, schema_editor):
+    """
+    Keep one account per normalized email before the unique index is created.
+
+    The account that logged in most recently, or else the oldest one, keeps
+    the email. The others are deactivated and their email is cleared.
+    """
+    User = apps.get_model('auth', 'User')
+    users = User.objects.using(schema_editor.connection.alias).annotate(email_key=Lower(Trim('email'))).exclude(email='')
+    duplicated_keys = list(
+        users.values('email_key').annotate(count=Count('id')).filter(count__gt=1).values_list('email_key', flat=True)
+    )
+    for key in duplicated_keys:
+        ids = list(
+            users.filter(email_key=key).order_by(F('last_login').desc(nulls_last=True), 'id').values_list('id', flat=True)
+        )
+        User.objects.using(schema_editor.connection.alias).filter(id__in=ids[1:]).update(is_active=False, email='')
+
+
+def add_email_key_index(apps, schema_editor):
+    schema_editor.add_constraint(apps.get_model('auth', 'User'), EMAIL_KEY_CONSTRAINT)
+
+
+def remove_email_key_index(apps, schema_editor):
+    schema_editor.remove_constraint(apps.get_model('auth', 'User'), EMAIL_KEY_CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_emails, migrations.RunPython.noop),
+        migrations.RunPython(add_email_key_index, remove_email_key_index),
+    ]
@@ -0,0 +1,71 @@
+from django.contrib.auth.models import User
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from connection.models import FriendEntry, PendingRequestEntry, SentRequestEntry
+from connection.versions import CONNECTIONS, PROFILE, bump_versions
+from .autocomplete import user_registered
+
+# The user fields shown in other users' friend, pending and sent lists
+LIST_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+# The tables behind the friend, sent and pending lists
+ENTRY_MODELS = (FriendEntry, SentRequestEntry, PendingRequestEntry)
+
+
+def listing_owners(user_ids):
+    """
+    Return the ids of the users whose friend, pending or sent lists contain any of the given users.
+
+    Each M2M table is searched through its index on the listed user, and the
+    three lookups are combined with a UNION, which also removes duplicates.
+    """
+    lookups = [
+        entry.objects.filter(user_id__in=user_ids).values_list('userconnectionintermediatetable__user_id', flat=True)
+        for entry in ENTRY_MODELS
+    ]
+    return lookups[0].union(*lookups[1:])
+
+
+def users_changed(user_ids, update_fields=None):
+    """
+    Bump the versions of the data showing changed users.
+
+    Called for every saved user. QuerySet.update() sends no signal, so code
+    updating users that way must call it itself.
+
+    Args:
+        user_ids (list): The ids of the changed users.
+        update_fields (iterable): The fields changed, or None if any may have.
+    """
+    bump_versions(user_ids, PROFILE)
+    if update_fields is None or 'username' in update_fields:
+        # List entries keep a copy of the username to be sorted by it
+        username = Subquery(User.objects.filter(id=OuterRef('user_id')).values('username')[:1])
+        for entry in ENTRY_MODELS:
+            entry.objects.filter(user_id__in=user_ids).update(username=username)
+    if update_fields is None or LIST_FIELDS.intersection(update_fields):
+        bump_versions(listing_owners(user_ids), CONNECTIONS)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields, **kwargs):
+    """
+    Bump the versions of the data showing a changed user, or index a new one for autocomplete.
+    """
+    if created:
+        user_registered(instance)
+        return
+    users_changed([instance.pk], update_fields)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """
+    Bump the connection versions of the users listing a deleted user.
+
+    The user's M2M rows are deleted by cascade, which sends no m2m_changed
+    signal, so the owners are looked up before they go.
+    """
+    bump_versions(listing_owners([instance.pk]), CONNECTIONS)
@@ -1,9 +1,18 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.db import IntegrityError, connection, transaction
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
 from django.urls import reverse
+from connection.models import Block, UserConnectionIntermediateTable
+from demo_social.testing import CacheIsolatedTestCase
+from .autocomplete import PrefixIndex, build_index, get_index, publish_index, refresh_index, reset_index
+from .emails import users_with_email
 from .serializers import UserSerializer
+from .signals import listing_owners
+from unittest import mock
+import shutil
+import tempfile
 
 class UserAccountTests(TestCase):
 
@@ -51,6 +60,34 @@ class UserAccountTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('token', response.data)
 
+    def test_register_email_in_another_case(self):
+        data = {'password': 'newpass', 'email': ' User1@Example.COM '}
+        response = self.client.post(self.register_url, data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Email already in use, please login.')
+
+        # The index rejects duplicates that bypass the view
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user(username='other', password='pass', email='USER1@example.com')
+
+    def test_login_email_in_another_case(self):
+        data = {
+            'email': ' USER1@example.com',
+            'password': 'pass'
+        }
+        response = self.client.post(self.login_url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['token'], self.user1_token.key)
+
+    def test_login_by_username_without_email(self):
+        User.objects.create_superuser(username='admin', email='', password='adminpass')
+        response = self.client.post(self.login_url, {'email': 'admin', 'password': 'adminpass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('token', response.data)
+
+        response = self.client.post(self.login_url, {'email': 'admin', 'password': 'wrongpass'})
+        self.assertEqual(response.status_code, 400)
+
     def test_login_invalid_credentials(self):
         data = {
             'email': 'user1@example.com',
@@ -67,6 +104,18 @@ class UserAccountTests(TestCase):
         self.assertEqual(response.data['username'], 'user1@example.com')
         self.assertEqual(response.data['email'], 'user1@example.com')
 
+    def test_user_details_not_modified(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user1_token.key)
+        etag = self.client.get(self.user_details_url)['ETag']
+        response = self.client.get(self.user_details_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.user1.first_name = 'changed'
+        self.user1.save()
+        response = self.client.get(self.user_details_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['first_name'], 'changed')
+
     def test_search_users_by_email(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user1_token.key)
         response = self.client.get(self.search_users_url, {'keyword': 'user1@example.com'})
@@ -74,6 +123,18 @@ class UserAccountTests(TestCase):
         self.assertEqual(response.data['username'], 'user1@example.com')
         self.assertEqual(response.data['email'], 'user1@example.com')
 
+    def test_search_users_by_email_in_another_case(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user1_token.key)
+        response = self.client.get(self.search_users_url, {'keyword': 'User1@Example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.user1.id)
+
+    def test_email_lookup_uses_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The plan is checked in the SQLite EXPLAIN format')
+        plan = users_with_email('user1@example.com').explain()
+        self.assertIn('USING INDEX auth_user_email_key_uniq', plan)
+
     def test_search_users_by_name(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user1_token.key)
         response = self.client.get(self.search_users_url, {'keyword': 'user1'})
@@ -87,3 +148,146 @@ class UserAccountTests(TestCase):
         response = self.client.get(self.search_users_url, {'keyword': ''})
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.data['error'], 'Search keyword is required.')
+
+    # Friends are only written to the default database here, so it is read instead of the shards
+    @override_settings(CONNECTION_SHARDS=[])
+    def test_search_users_with_distance(self):
+        user2 = User.objects.create_user(first_name='user2', password='pass', username='user2@example.com')
+        user3 = User.objects.create_user(first_name='user2', password='pass', username='user3@example.com')
+        UserConnectionIntermediateTable.objects.create(user=self.user1).friends.add(user2)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user1_token.key)
+        response = self.client.get(self.search_users_url, {'keyword': 'user2', 'with_distance': 'true'})
+        self.assertEqual(response.status_code, 200)
+        distances = {user['id']: user['distance'] for user in response.data['results']}
+        self.assertEqual(distances, {user2.id: 1, user3.id: None})
+
+    def test_listing_owners(self):
+        owner1 = User.objects.create_user(username='owner1', password='pass')
+        owner2 = User.objects.create_user(username='owner2', password='pass')
+        UserConnectionIntermediateTable.objects.create(user=owner1).friends.add(self.user1)
+        connections = UserConnectionIntermediateTable.objects.create(user=owner2)
+        connections.sent_requests.add(self.user1)
+        connections.pending_requests.add(self.user1)
+        self.assertEqual(sorted(listing_owners([self.user1.id])), [owner1.id, owner2.id])
+
+        if connection.vendor == 'sqlite':
+            # Each M2M table is searched by the listed user, none is scanned
+            plan = listing_owners([self.user1.id]).explain()
+            self.assertNotRegex(plan, r'\bSCAN\b')
+            self.assertEqual(plan.count('(user_id=?)'), 3)
+
+
+class AutocompleteTests(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        # The index is kept per process between tests
+        reset_index()
+        self.addCleanup(reset_index)
+
+        self.user = User.objects.create_user(first_name='Mary', last_name='Jane Smith', password='pass',
+                                             email='mary@example.com', username='mary@example.com')
+        self.other = User.objects.create_user(first_name='Marc', last_name='Jones', password='pass',
+                                              email='jones@example.com', username='jones@example.com')
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = reverse('autocomplete_users')
+        build_index()
+
+    def suggest(self, prefix, **params):
+        response = self.client.get(self.url, {'q': prefix, **params})
+        self.assertEqual(response.status_code, 200)
+        return [user['id'] for user in response.data['results']]
+
+    def test_prefix_of_any_name_word_or_email(self):
+        self.assertEqual(self.suggest('mar'), [self.other.id, self.user.id])
+        self.assertEqual(self.suggest('JANE s'), [self.user.id])
+        self.assertEqual(self.suggest('jones@'), [self.other.id])
+        self.assertEqual(self.suggest('j', limit=1), [self.user.id])
+        self.assertEqual(self.suggest('zed'), [])
+
+    def test_registered_user_found_without_rebuild(self):
+        self.client.post(reverse('register'), {'email': 'mark@example.com', 'password': 'pass', 'first_name': 'Mark'})
+        new_user = User.objects.get(username='mark@example.com')
+
+        index = get_index()
+        self.assertIn(new_user.id, index.delta_ids)
+        self.assertEqual(self.suggest('mark'), [new_user.id])
+
+    def test_blocked_and_inactive_users_left_out(self):
+        marty = User.objects.create_user(first_name='Marty', password='pass', username='marty@example.com')
+        build_index()
+        Block.objects.create(blocker=self.other, blocked=self.user)
+        self.assertEqual(self.suggest('mar'), [marty.id, self.user.id])
+
+        User.objects.filter(id=marty.id).update(is_active=False)
+        self.assertEqual(self.suggest('mar'), [self.user.id])
+
+    def test_requests_never_build_the_index(self):
+        reset_index()
+        with mock.patch('users.autocomplete.start_refresher') as start_refresher, self.assertNumQueries(0):
+            self.assertEqual(get_index().search('mar', 10), [])
+        start_refresher.assert_called_once()
+
+    def test_refresh_swaps_in_a_rebuilt_index(self):
+        index = get_index()
+        User.objects.filter(id=self.other.id).update(first_name='Zed')
+        refresh_index()
+        self.assertIs(get_index(), index)
+
+        with override_settings(USER_AUTOCOMPLETE_REBUILD_SECONDS=0):
+            refresh_index()
+        self.assertIsNot(get_index(), index)
+        self.assertEqual(self.suggest('zed'), [self.other.id])
+        self.assertEqual(index.search('zed', 10), [])
+
+    def test_published_index_shared_by_workers(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        reset_index()
+        with override_settings(USER_AUTOCOMPLETE_INDEX_DIR=directory):
+            with mock.patch('users.autocomplete.threading.Thread') as thread:
+                self.assertEqual(self.suggest('mar'), [])
+            thread.assert_not_called()
+
+            publish_index(directory)
+            with self.assertNumQueries(0):
+                self.assertEqual(get_index().search('mar', 10), [self.other.id, self.user.id])
+
+            # Registrations handled by this process show up before the next publish
+            self.client.post(reverse('register'), {'email': 'mark@example.com', 'password': 'pass',
+                                                   'first_name': 'Mark'})
+            mark = User.objects.get(username='mark@example.com')
+            self.assertEqual(self.suggest('mark'), [mark.id])
+
+            User.objects.filter(id=self.other.id).update(first_name='Zed')
+            publish_index(directory)
+            index = get_index()
+            self.assertEqual(index.search('zed', 10), [self.other.id])
+            self.assertEqual(index.search('mark', 10), [mark.id])
+            self.assertEqual(index.delta, [])
+
+    def test_adds_leave_running_searches_alone(self):
+        index = get_index()
+        delta = index.delta
+        martha = self.other.id + 100
+        index.add(martha, 'Martha', '', 'martha@example.com')
+        # The list a search already holds is replaced, never changed
+        self.assertEqual(delta, [])
+        self.assertEqual(index.search('mar', 10), [self.other.id, martha, self.user.id])
+
+    def test_missing_prefix(self):
+        response = self.client.get(self.url, {'q': ' '})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Search text is required.')
+
+    def test_delta_merged_in_term_order(self):
+        index = PrefixIndex.build([(1, 'Ann', 'Lee', ''), (3, 'Anna', '', '')])
+        index.add(2, 'Anne', '', '')
+        index.add(4, 'Andy', 'Annis', '')
+        self.assertEqual(index.search('ann', 10), [1, 3, 2, 4])
+        self.assertEqual(index.search('ann', 10, exclude={3}), [1, 2, 4])
+        self.assertEqual(index.term_count, 6)
@@ -6,4 +6,5 @@ urlpatterns = [
     path('login/', views.login, name='login'),
     path('user/', views.user_details, name='user_details'),
     path('search/', views.search_users, name='search_users'),
+    path('autocomplete/', views.autocomplete_users, name='autocomplete_users'),
 ]
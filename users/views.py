@@ -6,10 +6,16 @@ from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import api_view, permission_classes
+from django.db import IntegrityError, transaction
 from django.db.models import Value as V
 from django.db.models.functions import Concat 
 import re
 
+from django.conf import settings
+from connection.blocking import blocked_user_ids, exclude_blocked
+from connection.versions import PROFILE, conditional_on_version
+from .autocomplete import get_index
+from .emails import get_user_by_email, normalize_email, users_with_email
 from .serializers import UserSerializer
 
 @api_view(['POST'])
@@ -20,7 +26,8 @@ def register(request):
 
     This view handles user registration by creating a new user with the provided
     name, password, and email. It also generates an authentication token for
-    the newly registered user.
+    the newly registered user. Emails are stored normalized, so the same
+    address in another case or with surrounding spaces cannot register twice.
 
     Args:
         request (HttpRequest): The request object containing 'first_name','last_name',  'password',
@@ -35,25 +42,29 @@ def register(request):
     first_name = request.data.get('first_name',"")
     last_name = request.data.get('last_name',"")
     password = request.data.get('password')
-    email = request.data.get('email')
+    email = normalize_email(request.data.get('email'))
     username = email
 
     if not username or not password or not email:
         return Response({'error': 'Please provide all required fields'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if User.objects.filter(username=username).first():
+    if get_user_by_email(email):
         return Response({'error': 'Email already in use, please login.'}, status=status.HTTP_400_BAD_REQUEST)
     
     regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
     if not (re.fullmatch(regex, email)):
         return Response({'error': 'Email invalid, please retry.'}, status=status.HTTP_400_BAD_REQUEST)
     
-    user = User.objects.create_user(username=username, 
-                                    password=password, 
-                                    email=email, 
-                                    first_name= first_name, 
-                                    last_name=last_name)
-    user.save()
+    try:
+        # The unique indexes catch a concurrent registration of the same email
+        with transaction.atomic():
+            user = User.objects.create_user(username=username, 
+                                            password=password, 
+                                            email=email, 
+                                            first_name= first_name, 
+                                            last_name=last_name)
+    except IntegrityError:
+        return Response({'error': 'Email already in use, please login.'}, status=status.HTTP_400_BAD_REQUEST)
     token, _ = Token.objects.get_or_create(user=user)
 
     return Response({'token': token.key}, status=status.HTTP_201_CREATED)
@@ -64,7 +75,9 @@ def login(request):
     """
     Log in an existing user.
 
-    This view handles user login by authenticating the provided email and password.
+    This view handles user login by authenticating the provided email, in any
+    case, and password. Accounts without an email, such as those created by
+    createsuperuser, log in with their username in the email field instead.
     If the credentials are valid, it returns an authentication token.
 
     Args:
@@ -78,7 +91,8 @@ def login(request):
     email = request.data.get('email')
     password = request.data.get('password')
 
-    user = authenticate(request, username=email, password=password)
+    user = (authenticate(request, email=email, password=password)
+            or authenticate(request, username=email, password=password))
     if user is not None:
         token, _ = Token.objects.get_or_create(user=user)
         return Response({'token': token.key}, status=status.HTTP_200_OK)
@@ -87,11 +101,14 @@ def login(request):
 
 
 @api_view(['GET'])
+@conditional_on_version(PROFILE)
 def user_details(request):
     """
     Retrieve details of the authenticated user.
 
-    This view returns the details of the authenticated user.
+    This view returns the details of the authenticated user. The response
+    carries an ETag, and a request with a matching If-None-Match header gets
+    a 304.
 
     Args:
         request (HttpRequest): The request object containing the authenticated user token.
@@ -110,12 +127,14 @@ def search_users(request):
     """
     Search for users by email or username.
 
-    This view allows searching for users by a keyword, which can match the exact email
-    or any part of the username.
+    This view allows searching for users by a keyword, which can match the email,
+    in any case, or any part of the username. Users related to the authenticated user by a block
+    are excluded from the results. When 'with_distance' is set, every result also
+    carries its degree of connection to the authenticated user.
 
     Args:
-        request (HttpRequest): The request object containing the 'keyword' in the
-                               query parameters.
+        request (HttpRequest): The request object containing the 'keyword' and the
+                               optional 'with_distance' in the query parameters.
 
     Returns:
         Response: A Response object containing the search results.
@@ -123,18 +142,23 @@ def search_users(request):
     keyword = request.query_params.get('keyword', '').strip()
     page = int(request.query_params.get('page', 1))
     page_size = 10
+    with_distance = request.query_params.get('with_distance', '').lower() in ('1', 'true')
 
     if not keyword:
         return Response({'error': 'Search keyword is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Search by email
-    user = User.objects.filter(email=keyword).first()
+    # Search by email, a single index lookup
+    user = exclude_blocked(users_with_email(keyword), request.user).first() if '@' in keyword else None
     if user:
         serializer = UserSerializer(user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        data = serializer.data
+        if with_distance:
+            add_distances(request.user, [data])
+        return Response(data, status=status.HTTP_200_OK)
         
     # Search by name
     users = User.objects.annotate(full_name=Concat('first_name', V(' '), 'last_name')).filter(full_name__icontains=keyword)
+    users = exclude_blocked(users, request.user)
     total_users = users.count()
 
     # Paginate
@@ -149,12 +173,68 @@ def search_users(request):
         next_page_url = None
 
     serializer = UserSerializer(paginated_users, many=True)
+    results = serializer.data
+    if with_distance:
+        add_distances(request.user, results)
 
     return Response({
         'total': total_users,
         'page': page,
         'page_size': page_size,
-        'results': serializer.data,
+        'results': results,
         'next': next_page_url
     }, status=status.HTTP_200_OK)
 
+@api_view(['GET'])
+def autocomplete_users(request):
+    """
+    Suggest users whose name or email starts with the text typed so far.
+
+    Unlike search_users, this view neither scans nor counts the users table:
+    candidates come from an in-memory prefix index and only the returned
+    users are loaded, by primary key. Users related to the authenticated user
+    by a block are left out.
+
+    Args:
+        request (HttpRequest): The request object containing 'q' and the optional
+                               'limit' (at most 20) in the query parameters.
+
+    Returns:
+        Response: A Response object containing the suggested users.
+    """
+    prefix = request.query_params.get('q', '')
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), 20)
+    except ValueError:
+        return Response({'error': 'limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not prefix.strip():
+        return Response({'error': 'Search text is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    user_ids = get_index().search(prefix, limit, exclude=blocked_user_ids(request.user.id))
+    # Users deactivated or deleted since the index was built are dropped here
+    users = User.objects.filter(is_active=True).in_bulk(user_ids)
+    results = UserSerializer([users[user_id] for user_id in user_ids if user_id in users], many=True).data
+
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+def add_distances(user, results):
+    """
+    Annotate serialized users with their degree of connection to the given user.
+
+    All distances are computed by one breadth-first search, which issues a
+    single query per level of the search.
+
+    Args:
+        user (User): The user the distances are measured from.
+        results (list): The serialized users, updated in place with a 'distance' key.
+    """
+    # The graph and snapshot modules are only needed here, keep them off the startup path
+    from connection.graph import distances_from, friend_loader
+
+    distances = distances_from(user.id, [result['id'] for result in results],
+                               max_depth=settings.CONNECTION_DISTANCE_MAX_DEPTH,
+                               max_frontier=settings.CONNECTION_DISTANCE_MAX_FRONTIER,
+                               load_neighbors=friend_loader())
+    for result in results:
+        result['distance'] = distances[result['id']]